@@ -26,6 +26,44 @@ def create_app(config_class=Config):
     login.init_app(app)
     bootstrap.init_app(app)
 
+    from app.activity import LastSeenTracker
+    from app.apicalls import create_http_session
+    from app.cache import TTLCache, SingleFlight
+    from app.corpus import QuoteSampler
+    from app.executor import create_executor
+
+    app.http_session = create_http_session(app.config)
+    app.last_seen = LastSeenTracker(
+        app,
+        app.config["LAST_SEEN_FLUSH_INTERVAL"],
+        app.config["LAST_SEEN_GRANULARITY"],
+    )
+    app.executor = create_executor(app.config["EXECUTOR_WORKERS"])
+    app.pairing_executor = create_executor(
+        app.config["PAIRING_WORKERS"], "pairing-executor"
+    )
+    app.quote_sampler = QuoteSampler(
+        app.config["QUOTE_CORPUS_REFRESH"],
+        weighted=app.config["RATED_QUOTE_SAMPLING"],
+        prior_mean=app.config["RATING_PRIOR_MEAN"],
+        exponent=app.config["RATED_QUOTE_SAMPLING_EXPONENT"],
+        min_size=app.config["QUOTE_CORPUS_MIN_SIZE"],
+    )
+    app.noun_cache = TTLCache(app.config["NOUN_CACHE_SIZE"])
+    app.metadata_cache = TTLCache(
+        app.config["METADATA_CACHE_SIZE"], app.config["METADATA_CACHE_TTL"]
+    )
+    app.single_flight = SingleFlight()
+    app.user_cache = TTLCache(app.config["USER_CACHE_SIZE"], app.config["USER_CACHE_TTL"])
+    app.page_cache = TTLCache(
+        app.config["PAGE_CACHE_MAX_BYTES"],
+        app.config["PAGE_CACHE_TTL"],
+        weigh=lambda page: len(page[0]),
+    )
+    app.search_cache = TTLCache(
+        app.config["UNSPLASH_SEARCH_CACHE_SIZE"], app.config["UNSPLASH_SEARCH_CACHE_TTL"]
+    )
+
     # register the blueprints
     from app.auth import bp as auth_bp
 
@@ -39,6 +77,41 @@ def create_app(config_class=Config):
 
     app.register_blueprint(errors_bp)
 
+    from app.metrics import bp as metrics_bp
+
+    app.register_blueprint(metrics_bp)
+
+    from app.core.quoteprocessing import tagger
+    from app.instrumentation import Instrumentation
+    from app.profiling import profiler
+
+    tagger.init_app(app)
+    app.instrumentation = Instrumentation(app)
+    profiler.init_app(app)
+
+    from app.core.pairing import PairingBuffer
+
+    app.pairing_buffer = PairingBuffer(
+        app,
+        app.config["PAIRING_BUFFER_SIZE"],
+        app.config["PAIRING_BUFFER_LOW_WATER"],
+        app.config["PAIRING_BUFFER_MAX_RATE"],
+    )
+
+    from app.core.similarity import CorpusSimilarityIndex
+
+    app.similarity_index = CorpusSimilarityIndex(
+        app,
+        app.config["SIMILARITY_REFRESH"],
+        force_interval=app.config["SIMILARITY_FORCE_INTERVAL"],
+    )
+
+    from app.core.channel import Channel
+
+    app.channel = Channel(
+        app, app.config["CHANNEL_INTERVAL"], app.config["CHANNEL_QUEUE_SIZE"]
+    )
+
     if not app.debug and not app.testing:
 
         # now logging to file
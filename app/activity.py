@@ -0,0 +1,128 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+
+from app import db
+from app.models import User
+
+# trackers to flush at interpreter shutdown; weak, so trackers of apps
+# that are gone (e.g. one per test app) are not kept alive
+_trackers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_trackers_on_exit():
+    for tracker in list(_trackers):
+        tracker._flush_on_exit()
+
+
+class LastSeenTracker:
+    """
+    Records user activity in memory and writes last_seen in periodic bulk
+    UPDATEs, instead of a commit on every request.
+
+    Args:
+        app: flask app, pending activity is flushed in its app context on shutdown
+        flush_interval (float): seconds between flushes
+        granularity (float): activity of a user within this many seconds of
+            the last recorded activity is not recorded again
+
+    A flush happens on the first recorded activity after flush_interval has
+    passed, and at interpreter shutdown.
+    """
+
+    def __init__(self, app, flush_interval=60, granularity=60):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.granularity = timedelta(seconds=granularity)
+        self._pending = {}
+        self._recorded = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self.records = 0
+        self.written = 0
+        self.flushes = 0
+        _trackers.add(self)
+
+    def record(self, user_id):
+        """
+        Records activity of a user
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            self.records += 1
+            last = self._recorded.get(user_id)
+            if last is None or now - last >= self.granularity:
+                self._recorded[user_id] = now
+                self._pending[user_id] = now
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+
+        if due:
+            try:
+                self.flush()
+            except Exception:
+                # kept pending, retried by the next flush
+                self.app.logger.exception("Could not flush last seen activity")
+
+    def flush(self):
+        """
+        Writes pending last_seen values in one bulk UPDATE; if it fails, the
+        values stay pending for the next flush
+
+        Returns:
+            number of users updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+            # forget users that can be recorded again anyway
+            cutoff = datetime.utcnow() - self.granularity
+            self._recorded = {
+                user_id: seen
+                for user_id, seen in self._recorded.items()
+                if seen > cutoff
+            }
+        if not pending:
+            return 0
+
+        user = User.__table__
+        try:
+            db.session.execute(
+                user.update()
+                .where(user.c.id == bindparam("user_id"))
+                .values(last_seen=bindparam("seen")),
+                [{"user_id": user_id, "seen": seen} for user_id, seen in pending.items()],
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                # activity recorded meanwhile is newer
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            raise
+        self.flushes += 1
+        self.written += len(pending)
+        return len(pending)
+
+    def _flush_on_exit(self):
+        if not self._pending:
+            return
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception:
+            self.app.logger.exception("Could not flush last seen activity")
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "records": self.records,
+            "flushes": self.flushes,
+            "written": self.written,
+            "writes_saved": self.records - self.written - len(self._pending),
+        }
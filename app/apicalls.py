@@ -1,11 +1,109 @@
 import requests
+from requests.adapters import HTTPAdapter
 
 from flask import current_app
 
+from app.corpus import get_quote_from_corpus, add_quotes_to_corpus
+from app.executor import submit
+from app.instrumentation import timed, url_host
 
-def get_api_data(url, headers={}):
-    response = requests.get(url, headers=headers,)
-    if response.status_code == 200:
+# marks a cache miss, as None and [] are valid cached results
+_MISSING = object()
+
+
+class QuoteUnavailable(Exception):
+    """The quotable api did not return the quote (error status, timeout or connection error)"""
+
+
+class QuoteNotFound(QuoteUnavailable):
+    """The quotable api does not know the quote id"""
+
+
+def create_http_session(config):
+    """
+    Creates the process-wide http session used for all api calls
+
+    The session keeps connections to the api hosts alive, so consecutive
+    calls skip the TCP and TLS handshakes. The pools block: a call that
+    finds all HTTP_POOL_MAXSIZE connections to its host in use waits for
+    one, instead of opening an extra connection that is discarded after
+    the call.
+
+    Args:
+        config: app config with HTTP_POOL_CONNECTIONS (number of hosts to
+            keep pools for) and HTTP_POOL_MAXSIZE (connections per host)
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=config["HTTP_POOL_CONNECTIONS"],
+        pool_maxsize=config["HTTP_POOL_MAXSIZE"],
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_pool_stats():
+    """
+    Returns per host statistics of the connection pools of the http session:
+    open connections, idle (kept-alive) connections and requests made
+    """
+    # one adapter is mounted for both http and https
+    pools = current_app.http_session.get_adapter("https://").poolmanager.pools
+    stats = []
+    for key in pools.keys():
+        pool = pools[key]
+        idle = sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0
+        stats.append(
+            {
+                "host": pool.host,
+                "scheme": pool.scheme,
+                "connections": pool.num_connections,
+                "idle": idle,
+                "requests": pool.num_requests,
+            }
+        )
+    return stats
+
+
+def api_url(base, endpoint):
+    """
+    Joins the base url of an api (QUOTABLE_API_URL, UNSPLASH_API_URL) and an
+    endpoint, with a single slash between them
+    """
+    return f"{base.rstrip('/')}/{endpoint.lstrip('/')}"
+
+
+def get_api_data(url, headers={}, statuses=(200,)):
+    """
+    GET request through the pooled http session, with connect and read timeouts
+
+    Args:
+        statuses (tuple): status codes to return the response for
+
+    Returns:
+        response if succesful, or None on other status, timeout or connection error
+    """
+    with timed("upstream", host=url_host(url)) as timing:
+        try:
+            response = current_app.http_session.get(
+                url,
+                headers=headers,
+                timeout=(
+                    current_app.config["HTTP_CONNECT_TIMEOUT"],
+                    current_app.config["HTTP_READ_TIMEOUT"],
+                ),
+            )
+        except requests.RequestException as error:
+            timing.labels["status"] = type(error).__name__
+            current_app.logger.warning(f"Api call to {url} failed: {error}")
+            return None
+        timing.labels["status"] = response.status_code
+    if response.status_code in statuses:
         return response
     else:
         return None
@@ -13,7 +111,7 @@ def get_api_data(url, headers={}):
 
 def get_image_from_unsplash_api(endpoint):
     return get_api_data(
-        f"https://api.unsplash.com/{endpoint}",
+        api_url(current_app.config["UNSPLASH_API_URL"], endpoint),
         {"Authorization": f"Client-ID {current_app.config['UNSPLASH_API_KEY']}"},
     )
 
@@ -22,24 +120,113 @@ def search_image_from_unsplash(noun):
     """
     Tries to fetch image with noun as keyword from unsplash
 
+    Results are cached per noun (current_app.search_cache), including nouns
+    without results, so popular and image-less nouns do not hit the api on
+    every page view. Failed api calls are not cached.
+
     Args:
        noun (str): noun
 
     Returns:
         results from response if succesful, or None if unsuccesful
     """
+    cache = current_app.search_cache
+    images = cache.get(noun, _MISSING)
+    if images is not _MISSING:
+        return images or None
+
     response = get_image_from_unsplash_api(f"/search/photos?query={noun}")
-    if response == None or response.json()["total"] == 0:
+    if response == None:
+        return None
+    data = response.json()
+    if data["total"] == 0:
+        cache.set(noun, [], ttl=current_app.config["UNSPLASH_SEARCH_CACHE_NEGATIVE_TTL"])
         return None
-    return response.json()["results"]
+    cache.set(noun, data["results"])
+    return data["results"]
 
 
 def get_quote(endpoint="random"):
     """
-    Returns quote from quoateable api
+    Returns quote from the local quote corpus, or from the quoteable api if
+    the corpus cannot serve the endpoint (empty corpus, unknown quote id)
+
+    Quotes by id ("quotes/<id>") are read through an in-process cache
+    (current_app.metadata_cache) and the corpus; a quote fetched from the
+    api is added to the corpus. Concurrent api calls for the same quote
+    are made only once. Random quotes from the api are not added: until
+    the corpus is synced, random draws from it would repeat those few.
+
+    Returns:
+        tuple with quote, author and id
+    """
+    if endpoint == "random":
+        return get_quote_from_corpus(endpoint) or fetch_quote(endpoint)
+
+    cache_key = ("quote", endpoint)
+    quote = current_app.metadata_cache.get(cache_key)
+    if quote:
+        return quote
+
+    quote = get_quote_from_corpus(endpoint) or current_app.single_flight.do(
+        cache_key, fetch_quote, endpoint
+    )
+    current_app.metadata_cache.set(cache_key, quote)
+    return quote
+
+
+def fetch_quote(endpoint="random"):
+    """
+    Fetches quote from quoteable api; quotes by id are added to the local
+    quote corpus
 
     Returns:
         tuple with quote, author and id
+
+    Raises:
+        QuoteNotFound: if the api does not know the quote id
+        QuoteUnavailable: if the api call failed otherwise
     """
-    response = get_api_data(f"https://api.quotable.io/{endpoint}")
-    return response.json()["content"], response.json()["author"], response.json()["_id"]
+    response = get_api_data(
+        api_url(current_app.config["QUOTABLE_API_URL"], endpoint), statuses=(200, 404)
+    )
+    if response is None:
+        raise QuoteUnavailable(endpoint)
+    if response.status_code == 404:
+        raise QuoteNotFound(endpoint)
+    data = response.json()
+    if endpoint != "random":
+        add_quotes_to_corpus([data])
+    return data["content"], data["author"], data["_id"]
+
+
+def get_quote_async(endpoint="random"):
+    """
+    Non-blocking variant of get_quote, runs on the app executor
+
+    Returns:
+        Future with the tuple of quote, author and id
+    """
+    return submit(get_quote, endpoint)
+
+
+def get_quotes_page(page=1):
+    """
+    Returns one page of quotes from the quoteable /quotes listing, used to
+    sync the local quote corpus in bulk
+
+    Args:
+        page (int): page number, starting at 1
+
+    Returns:
+        dict with results (list of quotes) and totalPages, or None if unsuccesful
+    """
+    limit = current_app.config["QUOTE_CORPUS_PAGE_SIZE"]
+    response = get_api_data(
+        api_url(
+            current_app.config["QUOTABLE_API_URL"], f"quotes?page={page}&limit={limit}"
+        )
+    )
+    if response == None:
+        return None
+    return response.json()
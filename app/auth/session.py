@@ -0,0 +1,25 @@
+from flask import session
+
+
+def session_only(view):
+    """
+    Marks a view as session-only: its requests identify the user by the id
+    in the session cookie, without loading the user (see get_session_user_id).
+
+    For hot, read-only endpoints like the slideshow polling, that do not
+    need current_user.
+    """
+    view.session_only = True
+    return view
+
+
+def get_session_user_id():
+    """
+    Id of the logged in user from the session, without a database lookup
+
+    Returns:
+        int, or None if the session has no logged in user
+    """
+    # Flask-Login < 0.5 stores user_id, later versions _user_id
+    user_id = session.get("_user_id") or session.get("user_id")
+    return int(user_id) if user_id else None
@@ -0,0 +1,170 @@
+import json
+import os
+from collections import Counter
+from datetime import timedelta
+
+import click
+import nltk
+
+from app.apicalls import get_quotes_page
+from app.corpus import add_quotes_to_corpus
+from app.core.nounstore import warm_noun_store
+from app.core.lexicon import build_lexicon, save_lexicon
+from app.core.quoteprocessing import PerceptronTagger
+from app.core.imageindex import refresh_image_index
+from app.profiling import load_profiles, aggregate_profiles
+from app.models import CorpusQuote, QuoteNouns
+
+
+def sync_quote_corpus(max_pages=None):
+    """
+    Pulls quotes in bulk from the quoteable api into the local corpus
+
+    Args:
+        max_pages (int): stop after this many pages (None: all pages)
+
+    Returns:
+        tuple with number of pages fetched and number of quotes added
+    """
+    page, added = 1, 0
+    while max_pages is None or page <= max_pages:
+        data = get_quotes_page(page)
+        if data is None or not data["results"]:
+            break
+        added += add_quotes_to_corpus(data["results"])
+        if page >= data["totalPages"]:
+            break
+        page += 1
+    return page, added
+
+
+def register(app):
+    @app.cli.group()
+    def corpus():
+        """Local quote corpus commands."""
+        pass
+
+    @corpus.command()
+    @click.option("--pages", type=int, default=None, help="Maximum number of pages")
+    def sync(pages):
+        """Sync the local quote corpus with the quoteable api."""
+        fetched, added = sync_quote_corpus(pages)
+        click.echo(f"Fetched {fetched} page(s), added {added} quote(s)")
+
+    @corpus.command()
+    @click.option("--processes", type=int, default=None, help="Tagging processes")
+    def tag(processes):
+        """Store the nouns of all corpus quotes that were not tagged yet."""
+        quotes = [(row.quote_id, row.quote) for row in CorpusQuote.query]
+        tagged = warm_noun_store(quotes, processes)
+        click.echo(f"Tagged {tagged} quote(s)")
+
+    @app.cli.group()
+    def images():
+        """Local noun -> image index commands."""
+        pass
+
+    @images.command()
+    @click.option("--limit", type=int, default=None, help="Maximum number of searches")
+    def refresh(limit):
+        """Index unsplash images for the nouns of the corpus quotes."""
+        # most frequent nouns first, as they are needed most often
+        noun_counts = Counter()
+        for row in QuoteNouns.query:
+            noun_counts.update(noun for noun, freq in json.loads(row.nouns))
+        nouns = [noun for noun, count in noun_counts.most_common()]
+
+        max_age = timedelta(days=app.config["IMAGE_INDEX_MAX_AGE"])
+        searched, indexed = 0, 0
+        while nouns and (limit is None or searched < limit):
+            batch_size = 100 if limit is None else min(100, limit - searched)
+            batch, nouns = nouns[:batch_size], nouns[batch_size:]
+            batch_searched, batch_indexed = refresh_image_index(batch, max_age)
+            searched += batch_searched
+            indexed += batch_indexed
+        click.echo(f"Searched {searched} noun(s), indexed images for {indexed}")
+
+    @app.cli.group("nltk")
+    def nltk_data():
+        """NLTK data commands."""
+        pass
+
+    @nltk_data.command()
+    def download():
+        """Download the NLTK data used for noun extraction."""
+        data_dir = app.config["NLTK_DATA_DIR"]
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        for package in ("punkt", "averaged_perceptron_tagger"):
+            if not nltk.download(package, download_dir=data_dir):
+                raise click.ClickException(f"Could not download {package}")
+
+    @nltk_data.command()
+    def lexicon():
+        """Build the noun lexicon of the lexicon engine from the POS tagger."""
+        path = app.config["NOUN_LEXICON_PATH"]
+        words = build_lexicon(PerceptronTagger())
+        save_lexicon(words, path, f"perceptron-nltk{nltk.__version__}")
+        click.echo(
+            f"Wrote {len(words['N'])} noun(s) and {len(words['A'])} likely noun(s)"
+            f" to {path}"
+        )
+
+    @app.cli.group()
+    def profile():
+        """Request profile commands."""
+        pass
+
+    @profile.command()
+    @click.option("--limit", type=int, default=20, help="Number of functions")
+    @click.option(
+        "--sort",
+        type=click.Choice(["cumulative", "self", "calls"]),
+        default="cumulative",
+        help="Order of the functions",
+    )
+    @click.option("--endpoint", default=None, help="Only dumps of this endpoint")
+    @click.option(
+        "--reason",
+        type=click.Choice(["sampled", "slow"]),
+        default=None,
+        help="Only sampled (cProfile) or slow (stack sampler) dumps",
+    )
+    def report(limit, sort, endpoint, reason):
+        """Aggregate the request profile dumps into the top functions."""
+        profiles = load_profiles(app.config["PROFILE_DIR"], endpoint, reason)
+        if not profiles:
+            raise click.ClickException(f"No profiles in {app.config['PROFILE_DIR']}")
+
+        routes = {}
+        for dump in profiles:
+            metadata = dump["metadata"]
+            route = routes.setdefault(
+                (metadata["endpoint"], metadata["reason"]), [0, 0.0, 0, 0.0]
+            )
+            route[0] += 1
+            route[1] += metadata["duration"]
+            route[2] += metadata["upstream_calls"]
+            route[3] += metadata["upstream_seconds"]
+        click.echo(
+            f"{'endpoint':<24} {'reason':<8} {'profiles':>8} {'mean':>10}"
+            f" {'upstream calls':>15} {'upstream':>10}"
+        )
+        for (route_endpoint, route_reason), (count, duration, calls, upstream) in sorted(
+            routes.items(), key=lambda item: item[1][0], reverse=True
+        ):
+            click.echo(
+                f"{str(route_endpoint):<24} {route_reason:<8} {count:>8}"
+                f" {duration / count * 1e3:>8.1f}ms {calls / count:>15.1f}"
+                f" {upstream / count * 1e3:>8.1f}ms"
+            )
+
+        click.echo()
+        click.echo(
+            f"{'cumulative':>12} {'self':>12} {'calls':>10} {'profiles':>8}  function"
+        )
+        for function in aggregate_profiles(profiles, sort, limit):
+            click.echo(
+                f"{function['cumulative'] * 1e3:>10.1f}ms {function['self'] * 1e3:>10.1f}ms"
+                f" {function['calls']:>10} {function['profiles']:>8}  {function['function']}"
+            )
@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+
+from app.core.pairing import make_pairing
+
+
+class Channel:
+    """
+    Shared slideshow: one pairing per tick, pushed to all subscribers, so
+    the pipeline work per tick does not grow with the number of viewers.
+
+    Args:
+        app: flask app, the ticker generates pairings in its app context
+        interval (float): seconds between slides
+        queue_size (int): slides a subscriber may lag behind before it is
+            dropped
+
+    The ticker thread is started by the first subscriber and idles while
+    there are no subscribers.
+    """
+
+    def __init__(self, app, interval, queue_size):
+        self.app = app
+        self.interval = interval
+        self.queue_size = queue_size
+        self.current = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._has_subscribers = threading.Event()
+        self._ticker = None
+        self.subscriptions = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.fanout_time = 0.0
+        self.last_fanout_latency = 0.0
+
+    def subscribe(self):
+        """
+        Returns a subscription (queue of pairings), starting with the
+        current slide
+        """
+        subscription = queue.Queue(maxsize=self.queue_size)
+        if self.current is not None:
+            subscription.put_nowait(self.current)
+        with self._lock:
+            self._subscribers.add(subscription)
+            self.subscriptions += 1
+            self._has_subscribers.set()
+            if self._ticker is None or not self._ticker.is_alive():
+                self._ticker = threading.Thread(
+                    target=self._tick, name="channel-ticker", daemon=True
+                )
+                self._ticker.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                self._has_subscribers.clear()
+
+    def is_subscribed(self, subscription):
+        return subscription in self._subscribers
+
+    def listen(self, subscription, keepalive):
+        """
+        Yields the pairings of a subscription, or None after keepalive
+        seconds without a slide; stops once the subscriber has been dropped
+        and unsubscribes when closed
+        """
+        try:
+            while self.is_subscribed(subscription):
+                try:
+                    yield subscription.get(timeout=keepalive)
+                except queue.Empty:
+                    yield None
+        finally:
+            self.unsubscribe(subscription)
+
+    def publish(self, pairing):
+        """
+        Pushes a pairing to all subscribers; subscribers whose queue is full
+        (slow or gone clients) are dropped
+        """
+        started = time.perf_counter()
+        self.current = pairing
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(pairing)
+                self.delivered += 1
+            except queue.Full:
+                self.unsubscribe(subscription)
+                self.dropped += 1
+        self.last_fanout_latency = time.perf_counter() - started
+        self.fanout_time += self.last_fanout_latency
+        self.published += 1
+
+    def _tick(self):
+        while True:
+            self._has_subscribers.wait()
+            started = time.monotonic()
+            try:
+                with self.app.app_context():
+                    pairing = self.app.pairing_buffer.pop() or make_pairing()
+                self.publish(pairing)
+            except Exception:
+                self.app.logger.exception("Could not publish slide")
+            wait = self.interval - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+    def stats(self):
+        return {
+            "connections": len(self._subscribers),
+            "subscriptions": self.subscriptions,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "drop_rate": self.dropped / self.subscriptions if self.subscriptions else 0.0,
+            "last_fanout_latency": self.last_fanout_latency,
+            "avg_fanout_latency": self.fanout_time / self.published
+            if self.published
+            else 0.0,
+        }
@@ -0,0 +1,118 @@
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.apicalls import search_image_from_unsplash
+from app.models import Image, ImageCandidate
+
+
+def lookup_candidates(nouns):
+    """
+    Looks up indexed images for nouns, in one query
+
+    Args:
+        nouns (list): nouns (str)
+
+    Returns:
+        dict noun -> list of tuples (url, colour, id); nouns without
+        indexed images are left out
+    """
+    rows = (
+        db.session.query(ImageCandidate.noun, Image.url, Image.colour, Image.id)
+        .join(Image)
+        .filter(ImageCandidate.noun.in_(nouns))
+    )
+    candidates = {}
+    for noun, url, colour, id in rows:
+        candidates.setdefault(noun, []).append((url, colour, id))
+    return candidates
+
+
+def get_image_record(id, max_age):
+    """
+    Looks up an image record by id
+
+    Args:
+        id (str): unsplash image id
+        max_age (timedelta): records fetched longer ago are ignored
+
+    Returns:
+        tuple (url, colour, id), or None if not found or too old
+    """
+    image = Image.query.get(id)
+    if image is None or image.fetched_at < datetime.utcnow() - max_age:
+        return None
+    return image.url, image.colour, image.id
+
+
+def store_image_record(result):
+    """
+    Stores an image record from an unsplash api result (/photos/:id)
+    """
+    image = Image.query.get(result["id"]) or Image(id=result["id"])
+    image.url = result["urls"]["regular"]
+    image.colour = result["color"]
+    image.fetched_at = datetime.utcnow()
+    db.session.add(image)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # stored concurrently by another worker
+        db.session.rollback()
+
+
+def index_images(noun, images):
+    """
+    Replaces the indexed images of a noun with unsplash search results
+
+    Args:
+        noun (str): noun
+        images (list): results of search_image_from_unsplash
+    """
+    now = datetime.utcnow()
+    ImageCandidate.query.filter_by(noun=noun).delete()
+    for result in {result["id"]: result for result in images}.values():
+        image = Image.query.get(result["id"]) or Image(id=result["id"])
+        image.url = result["urls"]["regular"]
+        image.colour = result["color"]
+        image.fetched_at = now
+        db.session.add(image)
+        db.session.add(ImageCandidate(noun=noun, image=image, fetched_at=now))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # indexed concurrently by another worker
+        db.session.rollback()
+
+
+def refresh_image_index(nouns, max_age):
+    """
+    Searches unsplash for nouns that are not indexed, or indexed longer
+    than max_age ago, and indexes the results
+
+    Args:
+        nouns (list): nouns (str), most important first
+        max_age (timedelta): age after which indexed images are refreshed
+
+    Returns:
+        tuple with number of nouns searched and number of nouns with images
+    """
+    fetched_at = dict(
+        db.session.query(ImageCandidate.noun, func.min(ImageCandidate.fetched_at))
+        .filter(ImageCandidate.noun.in_(nouns))
+        .group_by(ImageCandidate.noun)
+    )
+    stale = datetime.utcnow() - max_age
+
+    searched, indexed = 0, 0
+    for noun in nouns:
+        if noun in fetched_at and fetched_at[noun] > stale:
+            continue
+        searched += 1
+        images = search_image_from_unsplash(noun)
+        if images:
+            index_images(noun, images)
+            indexed += 1
+    return searched, indexed
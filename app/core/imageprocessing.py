@@ -1,9 +1,17 @@
 import re
 import random
+from datetime import timedelta
 
 from flask import current_app
 
 from app.apicalls import get_image_from_unsplash_api, search_image_from_unsplash
+from app.executor import submit
+from app.core.imageindex import (
+    lookup_candidates,
+    index_images,
+    get_image_record,
+    store_image_record,
+)
 
 
 def transform_hex_to_rgb(colour):
@@ -67,6 +75,32 @@ def get_font_colour(image_colour):
     return font_colour
 
 
+def search_top_nouns(nouns):
+    """
+    Search images for several nouns concurrently, on the app executor
+
+    Args:
+        nouns (list): sorted list of tuples (noun, frequency)
+
+    Returns:
+        tuple (noun, results) of the best ranked noun that has images, or
+        (None, None). Searches for lower ranked nouns are cancelled (if not
+        started yet) or ignored, once a better ranked noun has images.
+    """
+    futures = [
+        (noun, submit(search_image_from_unsplash, noun)) for noun, freq in nouns
+    ]
+    try:
+        for noun, future in futures:
+            images = future.result()
+            if images:
+                return noun, images
+    finally:
+        for noun, future in futures:
+            future.cancel()
+    return None, None
+
+
 def get_matching_image(nouns):
     """
     Select random image, based on most frequent nouns
@@ -75,12 +109,17 @@ def get_matching_image(nouns):
         nouns (list): sorted list of tuples (noun, frequency)
 
     Procedure:
-        1) loop through list
-            2) check whether there is an image
+        1) look up the nouns in the local image index
+            - if any noun is indexed, return a random image of the best
+              ranked indexed noun
+        2) search the top IMAGE_SEARCH_FANOUT nouns concurrently on unsplash
+            - take the results of the best ranked noun with images
+        3) if none of those has images, loop through the rest of the list
+            - check whether there is an image
                 - if so; break out of loop and return
                 - if not try next
-            3) if image is returned, return that url.
-                - If not, return standard image url
+        4) if image is returned, index the results and return that url.
+            - If not, return standard image url
     Raises:
         TypeError: type nouns is not list
         ValueError: first element of list is not a tuple
@@ -96,19 +135,28 @@ def get_matching_image(nouns):
     if type(nouns[0]) != tuple:
         raise ValueError("List must contain tuples (noun, frequency)")
 
-    image_url = None
+    candidates = lookup_candidates([noun for noun, freq in nouns])
     for noun, freq in nouns:
-        images = search_image_from_unsplash(noun)
-        if images:
-            random_index = random.randrange(len(images))
-            image = images[random_index]
-            image_url = image["urls"]["regular"]
-            image_colour = image["color"]
-            image_id = image["id"]
-            break
-
-    if image_url:
-        return image_url, image_colour, image_id
+        if noun in candidates:
+            return random.choice(candidates[noun])
+
+    images = None
+    fanout = current_app.config["IMAGE_SEARCH_FANOUT"]
+    if fanout > 1 and len(nouns) > 1:
+        noun, images = search_top_nouns(nouns[:fanout])
+        nouns = nouns[fanout:]
+
+    if not images:
+        for noun, freq in nouns:
+            images = search_image_from_unsplash(noun)
+            if images:
+                break
+
+    if images:
+        index_images(noun, images)
+        random_index = random.randrange(len(images))
+        image = images[random_index]
+        return image["urls"]["regular"], image["color"], image["id"]
     return current_app.config["STANDARD_IMAGE"]
 
 
@@ -120,8 +168,11 @@ def get_image_by_id(id):
         id (str): image id
 
     Procedure:
-        1) call unsplash api /photos/:id endpoint
-        2) extract url, color and id from response
+        1) look up the image in the in-process cache (current_app.metadata_cache)
+        2) look up the image record in the database
+        3) call unsplash api /photos/:id endpoint (once for concurrent
+           calls with the same id), store the record
+        4) extract url, color and id
 
     Returns:
         Tuple with:
@@ -130,13 +181,44 @@ def get_image_by_id(id):
             - Image id
         If no image is returned, will return standard image
     """
+    cache_key = ("image", id)
+    image = current_app.metadata_cache.get(cache_key)
+    if image:
+        return image
 
+    max_age = timedelta(days=current_app.config["METADATA_MAX_AGE"])
+    image = get_image_record(id, max_age) or current_app.single_flight.do(
+        cache_key, fetch_image_by_id, id
+    )
+    if image:
+        current_app.metadata_cache.set(cache_key, image)
+        return image
+    return current_app.config["STANDARD_IMAGE"]
+
+
+def fetch_image_by_id(id):
+    """
+    Fetches image from unsplash api and stores the image record
+
+    Returns:
+        tuple (url, colour, id), or None if unsuccesful
+    """
     image = get_image_from_unsplash_api(f"/photos/{id}")
     if image:
         image = image.json()
+        store_image_record(image)
         image_url = image["urls"]["regular"]
         image_colour = image["color"]
         image_id = image["id"]
         return image_url, image_colour, image_id
-    return current_app.config["STANDARD_IMAGE"]
+    return None
+
+
+def get_image_by_id_async(id):
+    """
+    Non-blocking variant of get_image_by_id, runs on the app executor
 
+    Returns:
+        Future with the tuple of url, colour and id
+    """
+    return submit(get_image_by_id, id)
@@ -0,0 +1,143 @@
+import string
+
+# bump when the rules of LexiconTagger change, so stored nouns are redone
+LEXICON_RULES_VERSION = 1
+
+NOUN = "N"
+LIKELY_NOUN = "A"
+OTHER = "O"
+
+PUNCTUATION = string.punctuation + "“”‘’…"
+
+# a likely noun right after these is mostly a verb ("to love", "we hope")
+VERB_CONTEXT = frozenset(
+    "to i we you they he she it will would can could should must may might "
+    "shall not never don't doesn't didn't won't can't let".split()
+)
+
+# an unknown word right after these is mostly a noun ("the zeitgeist")
+NOUN_CONTEXT = frozenset(
+    "a an the my your his her its our their this that these those every "
+    "each no some any of".split()
+)
+
+
+class LexiconTagger:
+    """
+    Noun tagger from a word list, as a fast alternative to the perceptron
+    tagger: one set lookup per token plus a look at the previous token.
+
+    Words are classified from the weights of the perceptron model, see
+    build_lexicon; words outside the lexicon are nouns after a determiner
+    or with a typical noun suffix. Tags are "NN" for nouns and "X" for
+    other tokens, so the result goes through count_nouns like pos_tag's.
+
+    Args:
+        nouns (iterable): words that are always nouns
+        likely_nouns (iterable): words that are nouns unless a verb context
+            precedes them
+        others (iterable): known words that are not nouns
+        suffixes (iterable): last three letters typical of nouns
+    """
+
+    def __init__(self, nouns=(), likely_nouns=(), others=(), suffixes=()):
+        self.nouns = frozenset(nouns)
+        self.likely_nouns = frozenset(likely_nouns)
+        self.others = frozenset(others)
+        self.suffixes = frozenset(suffixes)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a lexicon file written by save_lexicon
+        """
+        classes = {NOUN: [], LIKELY_NOUN: [], OTHER: [], "S": []}
+        with open(path, encoding="utf-8") as lexicon_file:
+            for line in lexicon_file:
+                if line.startswith("#"):
+                    continue
+                word_class, word = line.rstrip("\n").split("\t")
+                classes[word_class].append(word)
+        return cls(classes[NOUN], classes[LIKELY_NOUN], classes[OTHER], classes["S"])
+
+    def is_noun(self, word, previous):
+        if not word or word[0].isdigit():
+            return False
+        if word in self.nouns:
+            return True
+        if word in self.likely_nouns:
+            return previous not in VERB_CONTEXT
+        if word in self.others:
+            return False
+        return previous in NOUN_CONTEXT or word[-3:] in self.suffixes
+
+    def tag(self, tokens):
+        """
+        Tags a list of tokens, like nltk.pos_tag (nouns only)
+
+        Returns:
+            list of tuples (token, "NN" or "X")
+        """
+        tagged = []
+        previous = ""
+        for token in tokens:
+            word = token.strip(PUNCTUATION).lower()
+            tagged.append((token, "NN" if self.is_noun(word, previous) else "X"))
+            previous = word
+        return tagged
+
+
+def build_lexicon(perceptron):
+    """
+    Classifies the words (and suffixes) the perceptron model was trained on
+
+    Words of the tag dictionary (unambiguous in the training data) are nouns
+    or other words by their tag. For the other words, the weights of the
+    "i word" feature give the tag the word leans to by itself: nouns of
+    that kind become likely nouns. Suffixes ("i suffix") leaning to a noun
+    tag are kept for unknown words.
+
+    Args:
+        perceptron: loaded nltk PerceptronTagger
+
+    Returns:
+        dict word class (N, A, O or S for suffixes) -> sorted list of words
+    """
+    classes = {}
+    for word, tag in perceptron.tagdict.items():
+        classes.setdefault(word.lower(), NOUN if tag.startswith("NN") else OTHER)
+
+    suffixes = set()
+    for feature, weights in perceptron.model.weights.items():
+        kind, _, value = feature.rpartition(" ")
+        if kind not in ("i word", "i suffix") or not weights or not value.isalpha():
+            continue
+        leaning = max(weights, key=weights.get)
+        if kind == "i suffix":
+            if leaning.startswith("NN"):
+                suffixes.add(value)
+        elif value not in classes:
+            classes[value] = LIKELY_NOUN if leaning.startswith("NN") else OTHER
+
+    lexicon = {NOUN: [], LIKELY_NOUN: [], OTHER: [], "S": sorted(suffixes)}
+    for word, word_class in sorted(classes.items()):
+        lexicon[word_class].append(word)
+    return lexicon
+
+
+def save_lexicon(lexicon, path, source):
+    """
+    Writes a lexicon as lines "<class>\\t<word>"; source (e.g. the version of
+    the perceptron tagger) is recorded in a header line
+    """
+    with open(path, "w", encoding="utf-8") as lexicon_file:
+        lexicon_file.write(f"# {source}\n")
+        for word_class, words in lexicon.items():
+            for word in words:
+                lexicon_file.write(f"{word_class}\t{word}\n")
+
+
+def read_lexicon_source(path):
+    with open(path, encoding="utf-8") as lexicon_file:
+        header = lexicon_file.readline()
+    return header[2:].strip() if header.startswith("# ") else "unknown"
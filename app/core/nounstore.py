@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import QuoteNouns
+from app.core.quoteprocessing import tagger, get_nouns_from_quote, get_nouns_from_quotes
+
+
+def get_nouns_for_quote(quote_id, quote):
+    """
+    Nouns of a quote, read through an in-process LRU (current_app.noun_cache)
+    and the quote_nouns table, so every quote is tagged only once.
+
+    Stored nouns of another tagger version are tagged again and replaced.
+
+    Args:
+        quote_id (str): quotable id of the quote
+        quote (str): quote (English language) to be processed
+
+    Returns:
+        sorted list of tuples (noun, frequency), see get_nouns_from_quote
+    """
+    key = (tagger.version, quote_id)
+    nouns = current_app.noun_cache.get(key)
+    if nouns is not None:
+        return nouns
+
+    stored = QuoteNouns.query.get(quote_id)
+    if stored is not None and stored.tagger_version == tagger.version:
+        nouns = [tuple(noun) for noun in json.loads(stored.nouns)]
+    else:
+        nouns = get_nouns_from_quote(quote)
+        store_nouns({quote_id: nouns}, [stored] if stored else [])
+
+    current_app.noun_cache.set(key, nouns)
+    return nouns
+
+
+def store_nouns(nouns_by_quote_id, stored=()):
+    """
+    Inserts or updates the nouns of quotes for the current tagger version
+
+    Args:
+        nouns_by_quote_id (dict): quote id -> sorted list of (noun, frequency)
+        stored (list): QuoteNouns rows of these quotes that already exist
+    """
+    stored = {row.quote_id: row for row in stored}
+    for quote_id, nouns in nouns_by_quote_id.items():
+        row = stored.get(quote_id)
+        if row is None:
+            row = QuoteNouns(quote_id=quote_id)
+            db.session.add(row)
+        row.nouns = json.dumps(nouns)
+        row.tagger_version = tagger.version
+        row.tagged_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # tagged concurrently by another worker, that result is just as good
+        db.session.rollback()
+
+
+def warm_noun_store(quotes, processes=None):
+    """
+    Tags the quotes that have no stored nouns (of the current tagger
+    version) in one batch
+
+    Args:
+        quotes (list): tuples (quote_id, quote)
+        processes (int): worker processes for tagging, see get_nouns_from_quotes
+
+    Returns:
+        number of quotes tagged
+    """
+    quotes = dict(quotes)
+    stored = QuoteNouns.query.filter(QuoteNouns.quote_id.in_(list(quotes))).all()
+    up_to_date = {row.quote_id for row in stored if row.tagger_version == tagger.version}
+    to_tag = [quote_id for quote_id in quotes if quote_id not in up_to_date]
+    if not to_tag:
+        return 0
+
+    nouns = get_nouns_from_quotes([quotes[quote_id] for quote_id in to_tag], processes)
+    store_nouns(dict(zip(to_tag, nouns)), stored)
+    return len(to_tag)
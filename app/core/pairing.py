@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import deque
+
+from app.apicalls import get_quote
+from app.core.imageprocessing import (
+    get_matching_image,
+    transform_hex_to_rgb,
+    get_font_colour,
+)
+from app.core.nounstore import get_nouns_for_quote
+from app.instrumentation import timed
+
+
+def build_pairing(quote, author, quote_id, image, image_colour, image_id):
+    """
+    Combines quote and image into the payload of the quote views
+    (without url, as that needs a request context)
+
+    Returns:
+        dict with image, image_id, quote_id, quote, author,
+        image_colour_r/g/b and font_colour
+    """
+    r, g, b = transform_hex_to_rgb(image_colour)
+    font_colour = get_font_colour(image_colour)
+
+    return {
+        "image": image,
+        "image_id": image_id,
+        "quote_id": quote_id,
+        "quote": quote,
+        "author": author,
+        "image_colour_r": r,
+        "image_colour_g": g,
+        "image_colour_b": b,
+        "font_colour": font_colour,
+    }
+
+
+def make_pairing():
+    """
+    Runs the full pipeline: random quote, nouns, matching image, colours
+
+    Returns:
+        pairing dict, see build_pairing
+    """
+    with timed("quote"):
+        quote, author, quote_id = get_quote()
+    with timed("nouns"):
+        nouns = get_nouns_for_quote(quote_id, quote)
+    with timed("image_selection"):
+        image, image_colour, image_id = get_matching_image(nouns)
+    return build_pairing(quote, author, quote_id, image, image_colour, image_id)
+
+
+class PairingBuffer:
+    """
+    Bounded buffer of ready-made pairings, filled by a background producer,
+    so the quote views can answer from memory.
+
+    Args:
+        app: flask app, the producer runs make_pairing in its app context
+        size (int): capacity of the buffer (0 disables the buffer)
+        low_water (int): producer refills when depth drops below this mark
+        max_rate (float): maximum number of pairings produced per second
+
+    The producer thread is started on first use, not in create_app, so
+    that it runs in each (forked) worker and not in a pre-fork master.
+    """
+
+    def __init__(self, app, size, low_water, max_rate):
+        self.app = app
+        self.size = size
+        self.low_water = low_water
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self._pairings = deque(maxlen=size or None)
+        self._wanted = threading.Event()
+        self._lock = threading.Lock()
+        self._producer = None
+        self._produced_at = deque(maxlen=50)
+        self.hits = 0
+        self.misses = 0
+        self.produced = 0
+        self.errors = 0
+
+    def pop(self):
+        """
+        Returns the oldest buffered pairing, or None if the buffer is empty
+        """
+        if not self.size:
+            return None
+        self._ensure_producer()
+
+        try:
+            pairing = self._pairings.popleft()
+            self.hits += 1
+        except IndexError:
+            pairing = None
+            self.misses += 1
+
+        if len(self._pairings) < self.low_water:
+            self._wanted.set()
+        return pairing
+
+    def _ensure_producer(self):
+        if self._producer is not None and self._producer.is_alive():
+            return
+        with self._lock:
+            if self._producer is None or not self._producer.is_alive():
+                self._producer = threading.Thread(
+                    target=self._produce, name="pairing-producer", daemon=True
+                )
+                self._producer.start()
+                self._wanted.set()
+
+    def _produce(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            while len(self._pairings) < self.size:
+                started = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        pairing = make_pairing()
+                except Exception:
+                    self.errors += 1
+                    self.app.logger.exception("Could not produce pairing")
+                    time.sleep(5)
+                    continue
+                self._pairings.append(pairing)
+                self.produced += 1
+                self._produced_at.append(time.monotonic())
+
+                wait = self.min_interval - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+
+    def refill_rate(self):
+        """
+        Pairings produced per second, over the last 50 pairings
+        """
+        produced_at = list(self._produced_at)
+        if len(produced_at) < 2 or produced_at[-1] == produced_at[0]:
+            return 0.0
+        return (len(produced_at) - 1) / (produced_at[-1] - produced_at[0])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "depth": len(self._pairings),
+            "size": self.size,
+            "low_water": self.low_water,
+            "produced": self.produced,
+            "errors": self.errors,
+            "refill_rate": self.refill_rate(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
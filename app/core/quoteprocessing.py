@@ -1,5 +1,133 @@
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import gc
+import threading
+import time
+
 import nltk
+from nltk.tag.perceptron import PerceptronTagger
+
+from app.instrumentation import timed
+from app.core.lexicon import LexiconTagger, LEXICON_RULES_VERSION, read_lexicon_source
+
+
+class Tagger:
+    """
+    Loads the tagger of the noun extraction engine once per process
+
+    Engines:
+        perceptron: the NLTK averaged perceptron tagger
+        lexicon: LexiconTagger, a noun word list derived from the perceptron
+            model (`flask nltk lexicon`); much faster, slightly less accurate
+
+    The model is loaded lazily on first use, or eagerly by init_app when
+    NLTK_EAGER_LOAD is set. Eager loading in a pre-fork master (gunicorn
+    --preload) lets all workers share the model pages copy-on-write, and
+    takes the load off the first request of every worker.
+
+    Loading never downloads data, see `flask nltk download`.
+    """
+
+    def __init__(self, engine="perceptron", lexicon_path=None):
+        self.engine = engine
+        self.lexicon_path = lexicon_path
+        self._tagger = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.load_time = None
+
+    def init_app(self, app):
+        data_dir = app.config["NLTK_DATA_DIR"]
+        if data_dir not in nltk.data.path:
+            nltk.data.path.append(data_dir)
+        self.configure(
+            app.config["NOUN_EXTRACTION_ENGINE"], app.config["NOUN_LEXICON_PATH"]
+        )
+
+        if app.config["NLTK_EAGER_LOAD"]:
+            self.load()
+            # keep the collector of forked workers from touching (and thereby
+            # copying) the pages of the model (Python 3.7+)
+            if hasattr(gc, "freeze"):
+                gc.freeze()
+            app.logger.info(f"Loaded POS tagger in {self.load_time:.2f}s")
+
+    def configure(self, engine, lexicon_path=None):
+        """
+        Selects the engine; a loaded model of another engine is dropped
+        """
+        if engine not in ("perceptron", "lexicon"):
+            raise ValueError(f"Unknown noun extraction engine: {engine}")
+        with self._lock:
+            if (engine, lexicon_path) != (self.engine, self.lexicon_path):
+                self._tagger = None
+                self._version = None
+                self.load_time = None
+            self.engine = engine
+            self.lexicon_path = lexicon_path
+
+    def load(self):
+        """
+        Returns the tagger, loading the model if that did not happen yet
+        """
+        if self._tagger is None:
+            with self._lock:
+                if self._tagger is None:
+                    started = time.perf_counter()
+                    if self.engine == "lexicon":
+                        tagger = LexiconTagger.load(self.lexicon_path)
+                    else:
+                        tagger = PerceptronTagger()
+                    self.load_time = time.perf_counter() - started
+                    self._tagger = tagger
+        return self._tagger
+
+    @property
+    def loaded(self):
+        return self._tagger is not None
+
+    @property
+    def version(self):
+        """
+        Identifies the tagging model; results of different versions may differ
+        """
+        if self._version is None:
+            if self.engine == "lexicon":
+                source = read_lexicon_source(self.lexicon_path)
+                self._version = f"lexicon{LEXICON_RULES_VERSION}-{source}"
+            else:
+                self._version = f"perceptron-nltk{nltk.__version__}"
+        return self._version
+
+    def tag(self, tokens):
+        """
+        Tags a list of tokens, like nltk.pos_tag
+
+        Returns:
+            list of tuples (token, tag)
+        """
+        return self.load().tag(tokens)
+
+    def tag_sents(self, sentences):
+        """
+        Tags a list of token lists in one call, like nltk.pos_tag_sents
+
+        Returns:
+            list with, per sentence, a list of tuples (token, tag)
+        """
+        tagger = self.load()
+        return [tagger.tag(tokens) for tokens in sentences]
+
+    def stats(self):
+        return {
+            "engine": self.engine,
+            "version": self.version,
+            "loaded": self.loaded,
+            "load_time": self.load_time,
+        }
+
+
+tagger = Tagger()
 
 
 def get_nouns_from_quote(quote):
@@ -27,15 +155,40 @@ def get_nouns_from_quote(quote):
         for meaning of NLTK tags see: 
         https://www.ling.upenn.edu/courses/Fall_2003/ling001/penn_treebank_pos.html
     """
+    check_quote(quote)
+    with timed("tagging"):
+        parts_of_sentence = tagger.tag(tokenize_quote(quote))
+    return count_nouns(parts_of_sentence)
+
+
+def check_quote(quote):
+    """
+    Raises:
+        TypeError: type quote not string
+        ValueError: string of length 0
+    """
     if type(quote) != str:
         raise TypeError("Quote must be of type str")
 
     if len(quote) == 0:
         raise ValueError("Quote must be at least of length 1")
 
-    quote = quote.lower()
 
-    parts_of_sentence = nltk.pos_tag(quote.split(" "))
+def tokenize_quote(quote):
+    return quote.lower().split(" ")
+
+
+def count_nouns(parts_of_sentence):
+    """
+    Counts the nouns of a tagged quote
+
+    Args:
+        parts_of_sentence (list): tuples (word, tag)
+
+    Returns:
+        list of tuples (noun, frequency), sorted on frequency (descending)
+        and noun; [("wisdom", 1)] if there are no nouns
+    """
     nouns = [word for word, tag in parts_of_sentence if tag[:2] == "NN"]
 
     if nouns:
@@ -52,3 +205,53 @@ def get_nouns_from_quote(quote):
     ]
 
     return sorted_noun_counts
+
+
+def get_nouns_from_quotes(quotes, processes=None, chunksize=500):
+    """
+    Batch variant of get_nouns_from_quote, for corpus ingestion and cache
+    warming: all quotes are tagged in one call to the tagger.
+
+    Tagging is CPU-bound, so large inputs can be split over a process pool.
+
+    Args:
+        quotes (list): quotes (str, English language) to be processed
+        processes (int): number of worker processes; None or 1 tags in
+            this process
+        chunksize (int): quotes per worker task
+
+    Raises:
+        TypeError: type of a quote not string
+        ValueError: quote of length 0
+
+    Returns:
+        list with, per quote, the same sorted (noun, frequency) list as
+        get_nouns_from_quote
+    """
+    quotes = list(quotes)
+    for quote in quotes:
+        check_quote(quote)
+
+    if not processes or processes == 1 or len(quotes) <= chunksize:
+        return _get_nouns_from_chunk(quotes)
+
+    chunks = [quotes[i : i + chunksize] for i in range(0, len(quotes), chunksize)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(
+            _get_nouns_from_chunk,
+            chunks,
+            [list(nltk.data.path)] * len(chunks),
+            [(tagger.engine, tagger.lexicon_path)] * len(chunks),
+        )
+        return [nouns for chunk in results for nouns in chunk]
+
+
+def _get_nouns_from_chunk(quotes, data_path=None, engine=None):
+    # data_path and engine pass the NLTK data directories and the engine
+    # settings to spawned worker processes
+    if data_path:
+        nltk.data.path[:] = data_path
+    if engine:
+        tagger.configure(*engine)
+    tagged_quotes = tagger.tag_sents([tokenize_quote(quote) for quote in quotes])
+    return [count_nouns(parts_of_sentence) for parts_of_sentence in tagged_quotes]
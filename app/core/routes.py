@@ -1,61 +1,193 @@
-from datetime import datetime
-
-from flask import render_template, url_for, redirect, request, jsonify
+import hashlib
+import json
+
+from flask import (
+    render_template,
+    url_for,
+    redirect,
+    request,
+    jsonify,
+    current_app,
+    make_response,
+    Response,
+    stream_with_context,
+    abort,
+)
 
 from flask_login import current_user, login_required
 
+from app.auth.session import session_only, get_session_user_id
 from app.core import bp
 from app import db
 
-from app.apicalls import get_quote
-from app.core.imageprocessing import (
-    get_image_by_id,
-    get_matching_image,
-    transform_hex_to_rgb,
-    get_font_colour,
-)
-from app.core.quoteprocessing import get_nouns_from_quote
+from app.apicalls import get_quote_async
+from app.core.imageprocessing import get_image_by_id_async
+from app.core.pairing import build_pairing, make_pairing
+from app.executor import submit_to
+from app.instrumentation import timed
 
-from app.models import User, Quote
+from app.corpus import reweigh_corpus_quote
+from app.models import User, Quote, Rating, QuoteRating, CorpusQuote
 
 
 @bp.before_request
 def before_request():
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+    view = current_app.view_functions.get(request.endpoint)
+    if getattr(view, "session_only", False):
+        user_id = get_session_user_id()
+    elif current_user.is_authenticated:
+        user_id = current_user.id
+    else:
+        user_id = None
+
+    if user_id is not None:
+        current_app.last_seen.record(user_id)
+
+
+def quote_payload(pairing):
+    """
+    Adds the (social media) url of the quote view to a pairing
+    """
+    payload = dict(pairing)
+    payload["url"] = url_for(
+        "core.index",
+        quote_id=pairing["quote_id"],
+        image_id=pairing["image_id"],
+        _external=True,
+    )
+    return payload
+
+
+def get_random_pairing():
+    """
+    Pairing from the pre-generated buffer, or generated on the spot if the
+    buffer is empty
+    """
+    return current_app.pairing_buffer.pop() or make_pairing()
+
+
+def get_random_pairings(count):
+    """
+    Several pairings, from the pre-generated buffer as far as possible; the
+    rest is generated concurrently
+    """
+    pairings = []
+    while len(pairings) < count:
+        pairing = current_app.pairing_buffer.pop()
+        if pairing is None:
+            break
+        pairings.append(pairing)
+
+    futures = [
+        submit_to(current_app.pairing_executor, make_pairing)
+        for _ in range(count - len(pairings))
+    ]
+    return pairings + [future.result() for future in futures]
+
 
 @bp.route("/_get_quote")
+@session_only
 def _get_quote():
     """
-    
+    Random quote with matching image as json
 
+    See index for the payload
     """
-    print("hit")
-    quote, author, quote_id = get_quote()
-    nouns = get_nouns_from_quote(quote)
-    image, image_colour, image_id = get_matching_image(nouns)
-
-    r, g, b = transform_hex_to_rgb(image_colour)
-    font_colour = get_font_colour(image_colour)
-
-    response = {
-        "url": url_for(
-            "core.index", quote_id=quote_id, image_id=image_id, _external=True,
-        ),
-        "image": image,
-        "image_id": image_id,
-        "quote_id": quote_id,
-        "quote": quote,
-        "author": author,
-        "image_colour_r": r,
-        "image_colour_g": g,
-        "image_colour_b": b,
-        "font_colour": font_colour,
-    }
+    return jsonify(quote_payload(get_random_pairing()))
 
-    return jsonify(response)
 
+@bp.route("/_get_quotes")
+@session_only
+def _get_quotes():
+    """
+    Next slides of the slideshow as json, so the client fetches (and
+    preloads) several slides per request
+
+    Args:
+        count (int): number of quotes (at most QUOTE_BATCH_MAX, default 5)
+
+    Returns quotes, a list of payloads (see index)
+    """
+    count = request.args.get("count", 5, type=int)
+    count = max(1, min(count, current_app.config["QUOTE_BATCH_MAX"]))
+    pairings = get_random_pairings(count)
+    return jsonify({"quotes": [quote_payload(pairing) for pairing in pairings]})
+
+
+@bp.route("/_channel")
+@session_only
+def _channel():
+    """
+    Shared slideshow as a server-sent-events stream: every subscriber gets
+    the same slide per tick, see Channel
+
+    Each event carries a payload as json (see index); comments are sent as
+    keep-alive while there is no new slide
+    """
+    channel = current_app.channel
+    subscription = channel.subscribe()
+    keepalive = current_app.config["CHANNEL_KEEPALIVE"]
+
+    def stream():
+        for pairing in channel.listen(subscription, keepalive):
+            if pairing is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(quote_payload(pairing))}\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/similar/<quote_id>")
+def similar_quotes(quote_id):
+    """
+    Quotes of the corpus most similar to a quote (TF-IDF cosine over their
+    terms and nouns) as json
+
+    Args:
+        k (int): number of quotes (at most SIMILAR_QUOTES_MAX, default 5)
+
+    Returns quotes, a list of quote_id, quote, author and score; pending
+    and no quotes while the index is built in the background; 404 if the
+    quote is not indexed
+    """
+    k = request.args.get("k", 5, type=int)
+    k = max(1, min(k, current_app.config["SIMILAR_QUOTES_MAX"]))
+
+    index = current_app.similarity_index
+    index.sync_in_background()
+    similar = index.similar(quote_id, k)
+    if similar is None:
+        if not index.ready:
+            return jsonify({"quotes": [], "pending": True})
+        # possibly added to the corpus since the last sync
+        index.sync_in_background(force=True)
+        abort(404)
+
+    quotes = {
+        quote.quote_id: quote
+        for quote in CorpusQuote.query.filter(
+            CorpusQuote.quote_id.in_([similar_id for similar_id, _ in similar])
+        )
+    }
+    return jsonify(
+        {
+            "quotes": [
+                {
+                    "quote_id": similar_id,
+                    "quote": quotes[similar_id].quote,
+                    "author": quotes[similar_id].author,
+                    "score": score,
+                }
+                for similar_id, score in similar
+                if similar_id in quotes
+            ]
+        }
+    )
 
 
 @bp.route("/")
@@ -80,45 +212,138 @@ def index(quote_id=None, image_id=None):
 
     """
     if quote_id and image_id:
-        quote, author, quote_id = get_quote(f"quotes/{quote_id}")
-        image, image_colour, image_id = get_image_by_id(image_id)
+        return permalink(quote_id, image_id)
+
+    payload = quote_payload(get_random_pairing())
+    channel = request.args.get("channel", type=int) == 1
+
+    with timed("render"):
+        return render_template(
+            "index.html", image_view=True, payload=payload, channel=channel
+        )
+
+
+def permalink(quote_id, image_id):
+    """
+    Quote view of a social media link
+
+    The page only depends on quote_id, image_id and whether the user is
+    logged in, so rendered pages are cached (current_app.page_cache) with a
+    strong ETag: repeated views and conditional requests (304) need no
+    upstream calls and no rendering. Pages with the standard image instead
+    of the requested one (unsplash call failed) are not cached, so the next
+    view tries again.
+    """
+    key = (request.host_url, quote_id, image_id, current_user.is_authenticated)
+    page = current_app.page_cache.get(key)
+    if page is None:
+        # quote and image are independent, so fetch them concurrently
+        quote_future = get_quote_async(f"quotes/{quote_id}")
+        image_future = get_image_by_id_async(image_id)
+        quote, author, quote_id = quote_future.result()
+        image, image_colour, found_image_id = image_future.result()
+        pairing = build_pairing(
+            quote, author, quote_id, image, image_colour, found_image_id
+        )
+
+        with timed("render"):
+            body = render_template(
+                "index.html", image_view=True, payload=quote_payload(pairing)
+            ).encode("utf-8")
+        if found_image_id != image_id:
+            response = make_response(body)
+            response.cache_control.no_store = True
+            return response
+        page = body, hashlib.sha1(body).hexdigest()
+        current_app.page_cache.set(key, page)
+
+    body, etag = page
+    response = make_response(body)
+    response.set_etag(etag)
+    if current_user.is_authenticated:
+        response.cache_control.private = True
     else:
-        quote, author, quote_id = get_quote()
-        nouns = get_nouns_from_quote(quote)
-        image, image_colour, image_id = get_matching_image(nouns)
-
-    r, g, b = transform_hex_to_rgb(image_colour)
-    font_colour = get_font_colour(image_colour)
-
-    payload = {
-        "url": url_for(
-            "core.index", quote_id=quote_id, image_id=image_id, _external=True,
-        ),
-        "image": image,
-        "image_id": image_id,
-        "quote_id": quote_id,
-        "quote": quote,
-        "author": author,
-        "image_colour_r": r,
-        "image_colour_g": g,
-        "image_colour_b": b,
-        "font_colour": font_colour,
-    }
+        response.cache_control.public = True
+    response.cache_control.max_age = current_app.config["PAGE_CACHE_MAX_AGE"]
+    response.vary.add("Cookie")
+    return response.make_conditional(request)
 
-    return render_template("index.html", image_view=True, payload=payload)
+
+def get_saved_quotes(user_id, after=None):
+    """
+    One page of the saved quotes of a user, keyset-paginated by id
+
+    Args:
+        user_id (int): id of the user
+        after (int): id of the last quote of the previous page (None: first page)
+
+    Returns:
+        tuple with the rows (id, quote_id, image_id, quote, author) of the
+        page, and the id to pass as after for the next page (None if last page)
+    """
+    per_page = current_app.config["QUOTES_PER_PAGE"]
+    query = db.session.query(
+        Quote.id, Quote.quote_id, Quote.image_id, Quote.quote, Quote.author
+    ).filter(Quote.user_id == user_id)
+    if after is not None:
+        query = query.filter(Quote.id > after)
+    rows = query.order_by(Quote.id).limit(per_page + 1).all()
+
+    if len(rows) > per_page:
+        return rows[:per_page], rows[per_page - 1].id
+    return rows, None
 
 
-@login_required
 @bp.route("/myquotes")
+@login_required
 def myquotes():
     """
-    The quote-drawer, gives a plain overview of saved quotes.
+    The quote-drawer, gives a plain overview of saved quotes, one page at
+    a time (?after=<id of last quote of previous page>).
 
     Authentication needed
     """
     payload = dict()
-    payload["quotes"] = Quote.query.filter_by(user=current_user)
-    return render_template("myquotes.html", payload=payload)
+    payload["quotes"], payload["next"] = get_saved_quotes(
+        current_user.id, request.args.get("after", type=int)
+    )
+    with timed("render"):
+        return render_template("myquotes.html", payload=payload)
+
+
+@bp.route("/_myquotes")
+@login_required
+def _myquotes():
+    """
+    Page of saved quotes as json, for infinite scrolling of the quote-drawer
+
+    Args:
+        after (int): id of the last quote of the previous page
+
+    Returns quotes (quote_id, image_id, quote, author, url) and next, the
+    after value of the next page (null if this is the last page)
+
+    Authentication needed
+    """
+    rows, next_after = get_saved_quotes(
+        current_user.id, request.args.get("after", type=int)
+    )
+    quotes = [
+        {
+            "quote_id": row.quote_id,
+            "image_id": row.image_id,
+            "quote": row.quote,
+            "author": row.author,
+            "url": url_for(
+                "core.index", quote_id=row.quote_id, image_id=row.image_id
+            ),
+        }
+        for row in rows
+    ]
+    return jsonify({"quotes": quotes, "next": next_after})
+
+
+SAVE_KEYS = ["quote_id", "image_id", "quote", "author"]
 
 
 def is_valid_request(request_args, keys):
@@ -143,8 +368,24 @@ def is_valid_request(request_args, keys):
     return True
 
 
-@login_required
+def is_valid_quote(quote):
+    """
+    Helper function to check a quote to save from json: an object with
+    string values for SAVE_KEYS that fit their Quote columns
+
+    returns: bool whether quote can be saved
+    """
+    if not isinstance(quote, dict) or not is_valid_request(quote, SAVE_KEYS):
+        return False
+    columns = Quote.__table__.columns
+    return all(
+        isinstance(quote[key], str) and len(quote[key]) <= columns[key].type.length
+        for key in SAVE_KEYS
+    )
+
+
 @bp.route("/save", methods=["POST"])
+@login_required
 def save_quote():
     """
     Endpoint to save quote; called by js-function.
@@ -157,35 +398,84 @@ def save_quote():
 
     Returns succes or failure
 
-    For now, a manual check on constraints (check uniqueness), because
-    SQLlite does not support these constrains.
+    Uniqueness (user, quote_id, image_id) is enforced by a unique
+    constraint; the quote is saved in a single conditional insert.
 
     Authentication needed
     """
-    if not is_valid_request(request.form, ["quote_id", "image_id", "quote", "author"]):
+    if not is_valid_request(request.form, SAVE_KEYS):
         return jsonify({"error": "Could not save quote, due to technical reasons"})
-    quote_id = request.form["quote_id"]
-    image_id = request.form["image_id"]
-    quote = request.form["quote"]
-    author = request.form["author"]
-
-    check_uniqueness = (
-        Quote.query.filter_by(user=current_user)
-        .filter_by(quote_id=quote_id)
-        .filter_by(image_id=image_id)
-        .count()
-    )
 
-    if check_uniqueness == 0:
-        quote = Quote(
-            quote_id=quote_id,
-            image_id=image_id,
-            quote=quote,
-            author=author,
-            user=current_user,
-        )
-        db.session.add(quote)
-        db.session.commit()
+    if Quote.save_many(current_user.id, [request.form]):
         return jsonify({"succes": "Quote saved"})
     else:
         return jsonify({"error": "Quote already saved"})
+
+
+@bp.route("/save/bulk", methods=["POST"])
+@login_required
+def save_quotes():
+    """
+    Endpoint to save many quotes at once, e.g. by clients that were offline
+
+    Args (json):
+        quotes (list): objects with quote_id, image_id, quote and author
+            (at most SAVE_BULK_MAX)
+
+    Returns number of quotes saved and number of quotes already saved
+
+    Authentication needed
+    """
+    data = request.get_json(silent=True)
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("quotes"), list)
+        or len(data["quotes"]) > current_app.config["SAVE_BULK_MAX"]
+        or not all(is_valid_quote(quote) for quote in data["quotes"])
+    ):
+        return jsonify({"error": "Could not save quotes, due to technical reasons"})
+
+    saved = Quote.save_many(current_user.id, data["quotes"])
+    return jsonify({"saved": saved, "already_saved": len(data["quotes"]) - saved})
+
+
+@bp.route("/rate", methods=["POST"])
+@login_required
+def rate_quote():
+    """
+    Endpoint to rate a quote; called by js-function. Rating a quote again
+    replaces the earlier score.
+
+    Args:
+        quote_id (str): id of quote
+        score (int): 1 to 5
+
+    Returns the number of ratings and mean score of the quote
+
+    Authentication needed
+    """
+    score = request.form.get("score", type=int)
+    if not is_valid_request(request.form, ["quote_id"]) or score not in range(1, 6):
+        return jsonify({"error": "Could not rate quote, due to technical reasons"})
+
+    quote_rating = Rating.rate(current_user.id, request.form["quote_id"], score)
+    if quote_rating is None:
+        return jsonify({"error": "Could not rate quote, please try again"})
+
+    reweigh_corpus_quote(quote_rating)
+    return jsonify(rating_payload(quote_rating))
+
+
+@bp.route("/_rating/<quote_id>")
+def _rating(quote_id):
+    """
+    Number of ratings and mean score of a quote as json
+    """
+    quote_rating = QuoteRating.query.get(quote_id)
+    if quote_rating is None:
+        return jsonify({"count": 0, "mean": None})
+    return jsonify(rating_payload(quote_rating))
+
+
+def rating_payload(quote_rating):
+    return {"count": quote_rating.count, "mean": quote_rating.mean}
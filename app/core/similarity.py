@@ -0,0 +1,319 @@
+import json
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from app import db
+from app.models import CorpusQuote, QuoteNouns
+from app.core.quoteprocessing import tagger
+from app.core.nounstore import warm_noun_store
+
+TERM_PATTERN = re.compile(r"[a-z][a-z']{2,}")
+
+
+def get_quote_features(quote, nouns):
+    """
+    Terms of a quote for the similarity index: its words (of 3 letters or
+    more), with the nouns counted once more, so shared nouns weigh most
+
+    Args:
+        quote (str): quote text
+        nouns (list): tuples (noun, frequency), see get_nouns_from_quote
+
+    Returns:
+        Counter term -> frequency
+    """
+    features = Counter(TERM_PATTERN.findall(quote.lower()))
+    for noun, frequency in nouns:
+        for term in TERM_PATTERN.findall(noun):
+            features[term] += frequency
+    return features
+
+
+class GrowableArray:
+    """numpy array with amortised O(1) append (capacity doubles)"""
+
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        needed = self.size + len(values)
+        if needed > len(self._data):
+            data = np.empty(max(needed, 2 * len(self._data)), dtype=self._data.dtype)
+            data[: self.size] = self._data[: self.size]
+            self._data = data
+        self._data[self.size : needed] = values
+        self.size = needed
+
+    @property
+    def values(self):
+        return self._data[: self.size]
+
+
+class SimilarityIndex:
+    """
+    TF-IDF vectors of the quotes, for top-k cosine similarity.
+
+    Term counts are appended per quote to coordinate (row, column, count)
+    arrays, so adding quotes is cheap. Before a query after additions, the
+    counts are weighted (tf * idf, l2-normalised per row) and sorted by
+    column, giving per term the quotes it occurs in. A query only touches
+    the columns of its own terms; the top k is selected with argpartition.
+
+    Args:
+        max_df (float): terms in more than this fraction of the quotes (and
+            in more than 50) are left out, like stop words; they say little
+            about similarity and would make every query touch most quotes
+    """
+
+    def __init__(self, max_df=0.1):
+        self.max_df = max_df
+        self.quote_ids = []
+        self.rows_by_quote_id = {}
+        self.vocabulary = {}
+        self.last_pk = 0
+        self._rows = GrowableArray(np.int32)
+        self._columns = GrowableArray(np.int32)
+        self._counts = GrowableArray(np.float32)
+        self._row_starts = GrowableArray(np.int64)
+        self._row_starts.extend([0])
+        self._document_frequency = GrowableArray(np.int32)
+        self._built = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.quote_ids)
+
+    def add(self, quote_id, features):
+        """
+        Adds (or, if known, skips) a quote
+
+        Args:
+            quote_id (str): id of the quote
+            features (Counter): term -> frequency, see get_quote_features
+        """
+        with self._lock:
+            if quote_id in self.rows_by_quote_id:
+                return
+            columns = []
+            for term in features:
+                column = self.vocabulary.get(term)
+                if column is None:
+                    column = self.vocabulary[term] = len(self.vocabulary)
+                    self._document_frequency.extend([0])
+                columns.append(column)
+
+            row = len(self.quote_ids)
+            self.quote_ids.append(quote_id)
+            self.rows_by_quote_id[quote_id] = row
+            self._rows.extend([row] * len(columns))
+            self._columns.extend(columns)
+            self._counts.extend(list(features.values()))
+            self._row_starts.extend([self._columns.size])
+            np.add.at(self._document_frequency.values, columns, 1)
+            self._built = None
+
+    def _build(self):
+        built = self._built
+        if built is not None:
+            return built
+        with self._lock:
+            rows = self._rows.values
+            columns = self._columns.values
+            document_frequency = self._document_frequency.values
+            idf = np.log(
+                (1 + len(self.quote_ids)) / (1 + document_frequency.astype(np.float32))
+            ) + 1
+            common = document_frequency > max(self.max_df * len(self.quote_ids), 50)
+            weights = self._counts.values * idf[columns] * ~common[columns]
+            norms = np.sqrt(
+                np.bincount(rows, weights=weights * weights, minlength=len(self.quote_ids))
+            )
+            norms[norms == 0] = 1
+            weights = (weights / norms[rows]).astype(np.float32)
+
+            # postings per term, without the common terms
+            kept = np.flatnonzero(~common[columns])
+            order = kept[np.argsort(columns[kept], kind="stable")]
+            column_starts = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(columns[kept], minlength=len(self.vocabulary)),
+                out=column_starts[1:],
+            )
+            built = self._built = {
+                "weights": weights,
+                "row_starts": self._row_starts.values.copy(),
+                "columns": columns.copy(),
+                "column_starts": column_starts,
+                "column_rows": rows[order],
+                "column_weights": weights[order],
+                "size": len(self.quote_ids),
+            }
+        return built
+
+    def similar(self, quote_id, k=5):
+        """
+        Returns up to k most similar quotes
+
+        Args:
+            quote_id (str): id of an indexed quote
+            k (int): number of quotes
+
+        Returns:
+            list of tuples (quote_id, cosine similarity), most similar first;
+            None if the quote is not indexed
+        """
+        row = self.rows_by_quote_id.get(quote_id)
+        if row is None:
+            return None
+        built = self._build()
+        if row >= built["size"]:
+            return None
+
+        start, end = built["row_starts"][row], built["row_starts"][row + 1]
+        query_columns = built["columns"][start:end]
+        query_weights = built["weights"][start:end]
+
+        column_starts = built["column_starts"]
+        postings = [
+            slice(column_starts[column], column_starts[column + 1])
+            for column in query_columns
+        ]
+        if not postings:
+            return []
+        rows = np.concatenate([built["column_rows"][posting] for posting in postings])
+        weights = np.concatenate(
+            [
+                built["column_weights"][posting] * weight
+                for posting, weight in zip(postings, query_weights)
+            ]
+        )
+        scores = np.bincount(rows, weights=weights, minlength=built["size"])
+        scores[row] = 0
+
+        # select among the quotes sharing a term only
+        candidates = np.flatnonzero(scores)
+        k = min(k, len(candidates))
+        if k < 1:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.quote_ids[index], float(scores[index])) for index in top]
+
+    def stats(self):
+        return {
+            "quotes": len(self.quote_ids),
+            "terms": len(self.vocabulary),
+            "entries": self._columns.size,
+        }
+
+
+class CorpusSimilarityIndex(SimilarityIndex):
+    """
+    SimilarityIndex over the local quote corpus, catching up with quotes
+    added to the corpus (by primary key) at most every `refresh` seconds
+
+    Requests start the catching up on a background thread (see
+    sync_in_background) and do not wait for it; until the first sync is
+    done the index is not `ready`. Syncs requested for quotes that are not
+    indexed (force) run at most every `force_interval` seconds. Quotes
+    without stored nouns are tagged while catching up; run `flask corpus
+    tag` beforehand to keep the first sync short.
+    """
+
+    def __init__(self, app, refresh=300, batch_size=5000, force_interval=60):
+        super().__init__()
+        self.app = app
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.force_interval = force_interval
+        self._synced_at = None
+        self._forced_at = None
+        self._sync_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._synced_at is not None
+
+    def sync_in_background(self, force=False):
+        """
+        Starts sync on a background thread, unless one is running, the
+        index was synced less than `refresh` seconds ago, or (force) a
+        forced sync ran less than `force_interval` seconds ago
+
+        Returns:
+            whether a sync was started
+        """
+        now = time.monotonic()
+        with self._sync_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            if force:
+                if self._forced_at is not None and now - self._forced_at < self.force_interval:
+                    return False
+                self._forced_at = now
+            elif self._synced_at is not None and now - self._synced_at < self.refresh:
+                return False
+            self._thread = threading.Thread(
+                target=self._run_sync, name="similarity-sync", daemon=True
+            )
+            self._thread.start()
+        return True
+
+    def _run_sync(self):
+        with self.app.app_context():
+            try:
+                self.sync(force=True)
+            except Exception:
+                self.app.logger.exception("Could not sync similarity index")
+
+    def sync(self, force=False):
+        """
+        Adds corpus quotes that are not indexed yet
+
+        Returns:
+            number of quotes added
+        """
+        if (
+            not force
+            and self._synced_at is not None
+            and time.monotonic() - self._synced_at < self.refresh
+        ):
+            return 0
+
+        added = 0
+        with self._index_lock:
+            while True:
+                quotes = (
+                    CorpusQuote.query.filter(CorpusQuote.id > self.last_pk)
+                    .order_by(CorpusQuote.id)
+                    .limit(self.batch_size)
+                    .all()
+                )
+                if not quotes:
+                    break
+                nouns = self._load_nouns(quotes)
+                for quote in quotes:
+                    self.add(
+                        quote.quote_id,
+                        get_quote_features(quote.quote, nouns.get(quote.quote_id, [])),
+                    )
+                self.last_pk = quotes[-1].id
+                added += len(quotes)
+            self._synced_at = time.monotonic()
+        return added
+
+    def _load_nouns(self, quotes):
+        warm_noun_store([(quote.quote_id, quote.quote) for quote in quotes])
+        rows = db.session.query(QuoteNouns).filter(
+            QuoteNouns.quote_id.in_([quote.quote_id for quote in quotes]),
+            QuoteNouns.tagger_version == tagger.version,
+        )
+        return {row.quote_id: json.loads(row.nouns) for row in rows}
@@ -0,0 +1,313 @@
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import CorpusQuote, QuoteRating, insert_ignore
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over non-negative weights: changing a weight and
+    drawing an index with probability proportional to its weight are both
+    O(log n).
+    """
+
+    def __init__(self, weights):
+        self._weights = array("d", weights)
+        self._tree = array("d", [0.0])
+        self._tree.extend(self._weights)
+        size = len(self._weights)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return len(self._weights)
+
+    def total(self):
+        return self._prefix(len(self._weights))
+
+    def _prefix(self, count):
+        # sum of the first count weights
+        total = 0.0
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def append(self, weight):
+        """
+        Adds a weight at the end
+        """
+        i = len(self._weights) + 1
+        self._weights.append(weight)
+        # node i covers the weights i - lowbit(i) + 1 .. i
+        self._tree.append(weight + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def update(self, index, weight):
+        """
+        Sets the weight at index
+        """
+        delta = weight - self._weights[index]
+        self._weights[index] = weight
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, value):
+        """
+        Returns the first index at which the running sum of weights exceeds
+        value
+        """
+        size = len(self._weights)
+        index = 0
+        step = 1 << (size.bit_length() - 1) if size else 0
+        while step:
+            next_index = index + step
+            if next_index <= size and self._tree[next_index] <= value:
+                index = next_index
+                value -= self._tree[next_index]
+            step >>= 1
+        return min(index, size - 1)
+
+    def sample(self):
+        """
+        Returns a random index, with probability proportional to its weight
+        """
+        return self.find(random.random() * self.total())
+
+
+class QuoteSampler:
+    """
+    Keeps the primary keys of the local quote corpus in memory, so drawing
+    a random quote is one random index plus one primary key lookup (O(1)),
+    instead of an ORDER BY RANDOM() scan or an api call.
+
+    With `weighted`, quotes are drawn in proportion to their rating:
+    bayesian_mean ** exponent, unrated quotes weigh as much as the prior
+    mean. The weights live in a FenwickTree, so a draw is O(log n), a new
+    vote updates a single weight (see reweigh) and a new quote appends one
+    (see add).
+
+    The arrays are reloaded after `refresh` seconds, so quotes synced and
+    votes cast in another process eventually become part of the sample.
+
+    Below `min_size` quotes nothing is drawn: the corpus only holds the
+    quotes viewed by id until it is synced (`flask corpus sync`), and
+    drawing from those few would repeat them over and over.
+    """
+
+    def __init__(
+        self, refresh=300, weighted=False, prior_mean=3.0, exponent=2, min_size=0
+    ):
+        self.refresh = refresh
+        self.min_size = min_size
+        self.weighted = weighted
+        self.prior_mean = prior_mean
+        self.exponent = exponent
+        self._ids = None
+        self._weights = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._ids = None
+
+    def add(self, pks):
+        """
+        Appends new corpus quotes, unrated, without reloading the arrays
+
+        Args:
+            pks (list): primary keys of the new quotes
+        """
+        with self._lock:
+            ids = self._ids
+            if ids is None:
+                return
+            pks = sorted(pks)
+            if pks and ids and pks[0] <= ids[-1]:
+                # not at the end, reweigh relies on sorted ids
+                self._ids = None
+                return
+            weights = self._weights
+            for pk in pks:
+                if self.weighted and weights is not None:
+                    weights.append(self.weight(None))
+                ids.append(pk)
+
+    def weight(self, bayesian_mean):
+        if bayesian_mean is None:
+            bayesian_mean = self.prior_mean
+        return bayesian_mean ** self.exponent
+
+    def ids(self):
+        ids = self._ids
+        if ids is None or time.monotonic() - self._loaded_at > self.refresh:
+            with self._lock:
+                ids = self._ids
+                if ids is None or time.monotonic() - self._loaded_at > self.refresh:
+                    ids = self._load()
+        return ids
+
+    def _load(self):
+        if self.weighted:
+            rows = (
+                db.session.query(CorpusQuote.id, QuoteRating.bayesian_mean)
+                .outerjoin(QuoteRating, QuoteRating.quote_id == CorpusQuote.quote_id)
+                .order_by(CorpusQuote.id)
+                .all()
+            )
+            ids = array("l", (row.id for row in rows))
+            self._weights = FenwickTree(
+                self.weight(row.bayesian_mean) for row in rows
+            )
+        else:
+            rows = db.session.query(CorpusQuote.id).order_by(CorpusQuote.id)
+            ids = array("l", (row.id for row in rows))
+        self._ids = ids
+        self._loaded_at = time.monotonic()
+        return ids
+
+    def reweigh(self, pk, bayesian_mean):
+        """
+        Updates the weight of a corpus quote after a vote
+        """
+        ids, weights = self._ids, self._weights
+        if not self.weighted or ids is None or weights is None:
+            return
+        index = bisect_left(ids, pk)
+        if index < len(ids) and ids[index] == pk and index < len(weights):
+            weights.update(index, self.weight(bayesian_mean))
+
+    def sample(self):
+        """
+        Returns a random corpus primary key, or None if the corpus is empty
+        or smaller than min_size
+        """
+        ids = self.ids()
+        if not ids or len(ids) < self.min_size:
+            return None
+        weights = self._weights
+        if self.weighted and weights is not None and len(weights) == len(ids):
+            return ids[weights.sample()]
+        return ids[random.randrange(len(ids))]
+
+
+def as_quote_tuple(corpus_quote):
+    return corpus_quote.quote, corpus_quote.author, corpus_quote.quote_id
+
+
+def get_random_corpus_quote():
+    """
+    Draws a random quote from the local corpus
+
+    Returns:
+        tuple with quote, author and id, or None if the corpus is empty or
+        too small to draw from (see QuoteSampler)
+    """
+    pk = current_app.quote_sampler.sample()
+    if pk is None:
+        return None
+    corpus_quote = CorpusQuote.query.get(pk)
+    if corpus_quote is None:
+        # removed since the id array was loaded
+        current_app.quote_sampler.invalidate()
+        return None
+    return as_quote_tuple(corpus_quote)
+
+
+def reweigh_corpus_quote(quote_rating):
+    """
+    Passes the new rating of a quote on to the sampler of this process
+    """
+    pk = (
+        db.session.query(CorpusQuote.id)
+        .filter_by(quote_id=quote_rating.quote_id)
+        .scalar()
+    )
+    if pk is not None:
+        current_app.quote_sampler.reweigh(pk, quote_rating.bayesian_mean)
+
+
+def get_corpus_quote(quote_id):
+    """
+    Looks up a quote in the local corpus by its quotable id
+
+    Returns:
+        tuple with quote, author and id, or None if it is not in the corpus
+    """
+    corpus_quote = CorpusQuote.query.filter_by(quote_id=quote_id).first()
+    if corpus_quote is None:
+        return None
+    return as_quote_tuple(corpus_quote)
+
+
+def get_quote_from_corpus(endpoint):
+    """
+    Serves a quotable endpoint ("random" or "quotes/<id>") from the corpus
+
+    Returns:
+        tuple with quote, author and id, or None if the corpus cannot serve it
+    """
+    if endpoint == "random":
+        return get_random_corpus_quote()
+    if endpoint.startswith("quotes/"):
+        return get_corpus_quote(endpoint[len("quotes/") :])
+    return None
+
+
+def add_quotes_to_corpus(records):
+    """
+    Stores quotable quote records in the corpus, skipping known quotes
+    (also those added concurrently by another worker)
+
+    Args:
+        records (list): dicts with _id, content and author (quotable format)
+
+    Returns:
+        number of quotes added
+    """
+    records = {record["_id"]: record for record in records}
+    if not records:
+        return 0
+
+    known = {
+        row.quote_id
+        for row in db.session.query(CorpusQuote.quote_id).filter(
+            CorpusQuote.quote_id.in_(list(records))
+        )
+    }
+    new_ids = [quote_id for quote_id in records if quote_id not in known]
+    synced_at = datetime.utcnow()
+    added = insert_ignore(
+        CorpusQuote.__table__,
+        [
+            {
+                "quote_id": quote_id,
+                "quote": records[quote_id]["content"],
+                "author": records[quote_id]["author"],
+                "synced_at": synced_at,
+            }
+            for quote_id in new_ids
+        ],
+    )
+    db.session.commit()
+
+    if added:
+        current_app.quote_sampler.add(
+            [
+                row.id
+                for row in db.session.query(CorpusQuote.id).filter(
+                    CorpusQuote.quote_id.in_(new_ids)
+                )
+            ]
+        )
+    return added
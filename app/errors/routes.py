@@ -1,11 +1,31 @@
-from flask import render_template
+from flask import render_template, request, jsonify
 from app import db
+from app.apicalls import QuoteNotFound, QuoteUnavailable
 from app.errors import bp
 
+def wants_json():
+    # the endpoints called by js-functions are prefixed with an underscore
+    return (
+        request.path.startswith('/_')
+        or request.accept_mimetypes.best == 'application/json'
+    )
+
 @bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
+@bp.app_errorhandler(QuoteNotFound)
+def quote_not_found_error(error):
+    if wants_json():
+        return jsonify({'error': 'Quote not found'}), 404
+    return render_template('404.html'), 404
+
+@bp.app_errorhandler(QuoteUnavailable)
+def quote_unavailable_error(error):
+    if wants_json():
+        return jsonify({'error': 'Quotes are unavailable, please try again later'}), 503
+    return render_template('500.html'), 503
+
 @bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
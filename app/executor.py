@@ -0,0 +1,48 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+
+def create_executor(max_workers, name="quote-executor"):
+    """
+    Creates a process-wide, bounded thread pool
+
+    Args:
+        max_workers (int): maximum number of threads
+        name (str): prefix of the thread names
+    """
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the app executor, inside an app context
+
+    Returns:
+        concurrent.futures.Future
+    """
+    return submit_to(current_app.executor, fn, *args, **kwargs)
+
+
+def submit_to(executor, fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on executor, inside an app context and a copy
+    of the caller's context variables (so its stages are timed as part of
+    the submitting request, see app.instrumentation)
+
+    Tasks that submit to the app executor themselves and wait for the result
+    (like make_pairing) must run on another executor, otherwise a full app
+    executor can deadlock.
+
+    Returns:
+        concurrent.futures.Future
+    """
+    app = current_app._get_current_object()
+    context = contextvars.copy_context()
+
+    def run():
+        with app.app_context():
+            return context.run(fn, *args, **kwargs)
+
+    return executor.submit(run)
@@ -0,0 +1,218 @@
+import contextvars
+import threading
+import time
+from urllib.parse import urlsplit
+
+from flask import current_app, g, has_app_context, request
+
+# timings of the current request: list of (stage, seconds, labels), see timed
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations, as in Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Instrumentation:
+    """
+    Times the stages of a request (upstream calls, tagging, image
+    selection, rendering, see timed), and
+
+        - sends them per request in a Server-Timing header
+        - aggregates them per stage (and labels) in histograms, served in
+          Prometheus text format at /metrics
+
+    Stages that run on the executors count towards the request that
+    submitted them (see app.executor.submit_to). One per app (at
+    app.instrumentation), disabled unless INSTRUMENTATION_ENABLED is set;
+    timed then only looks up whether timings are collected (see
+    collect_timings).
+    """
+
+    def __init__(self, app, buckets=DEFAULT_BUCKETS):
+        self.enabled = app.config["INSTRUMENTATION_ENABLED"]
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def start_request_timings():
+            g.instrumentation_started = time.perf_counter()
+            g.instrumentation_token = collect_timings()
+
+        @app.after_request
+        def add_server_timing(response):
+            timings = collected_timings()
+            started = g.get("instrumentation_started")
+            if timings is None or started is None:
+                return response
+            total = time.perf_counter() - started
+            self.observe(
+                "request", total, endpoint=request.endpoint, status=response.status_code
+            )
+            response.headers["Server-Timing"] = server_timing(timings, total)
+            return response
+
+        @app.teardown_request
+        def reset_request_timings(exception=None):
+            token = g.pop("instrumentation_token", None)
+            if token is not None:
+                stop_collecting(token)
+
+    def observe(self, stage, seconds, **labels):
+        """
+        Adds a timing to the histogram of stage and labels
+        """
+        key = (stage,) + tuple(sorted((name, str(value)) for name, value in labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Returns the histograms in Prometheus text exposition format
+        """
+        lines = [
+            "# HELP quote_stage_seconds Time spent per stage of a request",
+            "# TYPE quote_stage_seconds histogram",
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for (stage, *labels), histogram in histograms:
+                label_text = ",".join(
+                    f'{name}="{escape_label(value)}"'
+                    for name, value in [("stage", stage)] + labels
+                )
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(
+                        f'quote_stage_seconds_bucket{{{label_text},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'quote_stage_seconds_bucket{{{label_text},le="+Inf"}} {histogram.count}'
+                )
+                lines.append(f"quote_stage_seconds_sum{{{label_text}}} {histogram.sum}")
+                lines.append(f"quote_stage_seconds_count{{{label_text}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def enabled_instrumentation():
+    """
+    Returns:
+        Instrumentation of the current app, None if it is disabled or
+        there is no app context
+    """
+    if not has_app_context():
+        return None
+    instrumentation = getattr(current_app, "instrumentation", None)
+    if instrumentation is None or not instrumentation.enabled:
+        return None
+    return instrumentation
+
+
+class timed:
+    """
+    Context manager that times a stage of the current request
+
+        with timed("upstream", host=host) as timing:
+            response = ...
+            timing.labels["status"] = response.status_code
+
+    Labels end up in the histograms of /metrics; keep their values few.
+    """
+
+    __slots__ = ("stage", "labels", "started", "instrumentation")
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.started = None
+        self.instrumentation = None
+
+    def __enter__(self):
+        self.instrumentation = enabled_instrumentation()
+        if self.instrumentation is not None or _request_timings.get() is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started is None:
+            return
+        seconds = time.perf_counter() - self.started
+        if self.instrumentation is not None:
+            self.instrumentation.observe(self.stage, seconds, **self.labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((self.stage, seconds, self.labels))
+
+
+def collect_timings():
+    """
+    Starts collecting the stage timings (see timed) of the current context,
+    also with instrumentation disabled
+
+    Returns:
+        token to pass to stop_collecting
+    """
+    return _request_timings.set([])
+
+
+def collected_timings():
+    """
+    Returns:
+        list of (stage, seconds, labels) timed in the current context so
+        far, None if timings are not collected
+    """
+    return _request_timings.get()
+
+
+def stop_collecting(token):
+    _request_timings.reset(token)
+
+
+def server_timing(timings, total):
+    """
+    Formats stage timings as a Server-Timing header value; repeated stages
+    are summed up (stages that ran concurrently can add up to more than
+    the total)
+    """
+    stages = {}
+    for stage, seconds, *labels in timings:
+        duration, count = stages.get(stage, (0.0, 0))
+        stages[stage] = (duration + seconds, count + 1)
+    metrics = [
+        f'{stage};dur={duration * 1000:.1f}' + (f';desc="{count}x"' if count > 1 else "")
+        for stage, (duration, count) in stages.items()
+    ]
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def url_host(url):
+    return urlsplit(url).netloc
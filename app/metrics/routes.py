@@ -0,0 +1,53 @@
+import hmac
+
+from flask import jsonify, current_app, Response, abort, request
+
+from app.apicalls import get_pool_stats
+from app.core.quoteprocessing import tagger
+from app.metrics import bp
+
+
+@bp.before_request
+def require_token():
+    """
+    The metrics are only served with METRICS_TOKEN as bearer token, and
+    not at all without one configured
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    authorization = request.headers.get("Authorization", "")
+    if not token or not hmac.compare_digest(authorization, f"Bearer {token}"):
+        abort(404)
+
+
+@bp.route("/_metrics")
+def _metrics():
+    """
+    Statistics of the in-process caches, buffers and connection pools as json
+    """
+    return jsonify(
+        {
+            "http_pools": get_pool_stats(),
+            "metadata_cache": current_app.metadata_cache.stats(),
+            "single_flight": current_app.single_flight.stats(),
+            "user_cache": current_app.user_cache.stats(),
+            "page_cache": current_app.page_cache.stats(),
+            "noun_cache": current_app.noun_cache.stats(),
+            "unsplash_search_cache": current_app.search_cache.stats(),
+            "last_seen": current_app.last_seen.stats(),
+            "pairing_buffer": current_app.pairing_buffer.stats(),
+            "channel": current_app.channel.stats(),
+            "similarity_index": current_app.similarity_index.stats(),
+            "tagger": tagger.stats(),
+        }
+    )
+
+
+@bp.route("/metrics")
+def metrics():
+    """
+    Per-stage timing histograms in Prometheus text format (empty unless
+    INSTRUMENTATION_ENABLED is set)
+    """
+    return Response(
+        current_app.instrumentation.render(), mimetype="text/plain; version=0.0.4"
+    )
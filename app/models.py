@@ -1,15 +1,45 @@
 from datetime import datetime
 
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from flask import current_app
+from flask import current_app, has_app_context
 from app import db, login
 from flask_login import UserMixin
 
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    """
+    Loads the logged in user, through a short-lived per-process cache
+    (current_app.user_cache) of read-only UserSnapshots
+    """
+    user = current_app.user_cache.get(int(id))
+    if user is None:
+        user = User.query.get(int(id))
+        if user is None:
+            return None
+        user = UserSnapshot(user)
+        current_app.user_cache.set(user.id, user)
+    return user
+
+
+class UserSnapshot(UserMixin):
+    """
+    Detached, read-only copy of the User fields needed on every request
+
+    Use User.query.get(current_user.id) to change a user.
+    """
+
+    def __init__(self, user):
+        self.__dict__.update(id=user.id, username=user.username, email=user.email)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only")
+
+    def __repr__(self):
+        return "<UserSnapshot {}>".format(self.username)
 
 
 class User(UserMixin, db.Model):
@@ -30,6 +60,50 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
 
+@db.event.listens_for(User, "after_update")
+@db.event.listens_for(User, "after_delete")
+def invalidate_user_snapshot(mapper, connection, user):
+    # password or profile changed; other processes expire by USER_CACHE_TTL
+    if has_app_context():
+        current_app.user_cache.delete(user.id)
+
+
+def insert_ignore(table, rows):
+    """
+    Inserts rows, skipping rows that violate a unique constraint: one
+    conditional insert where the database supports it, otherwise one
+    savepoint per row. Does not commit.
+
+    Args:
+        table: sqlalchemy table
+        rows (list): dicts of column values
+
+    Returns:
+        number of rows inserted
+    """
+    if not rows:
+        return 0
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(table).values(rows).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        statement = table.insert().values(rows).prefix_with("OR IGNORE")
+    elif dialect == "mysql":
+        statement = table.insert().values(rows).prefix_with("IGNORE")
+    else:
+        inserted = 0
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(row))
+                inserted += 1
+            except IntegrityError:
+                pass
+        return inserted
+    return db.session.execute(statement).rowcount
+
+
 class Quote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     image_id = db.Column(db.String(64))
@@ -37,3 +111,203 @@ class Quote(db.Model):
     quote = db.Column(db.String(300))
     author = db.Column(db.String(300))
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+
+    __table_args__ = (
+        # serves the keyset-paginated quote drawer of a user
+        db.Index("ix_quote_user_id_id", "user_id", "id"),
+        db.UniqueConstraint(
+            "user_id", "quote_id", "image_id", name="uq_quote_user_id_quote_id_image_id"
+        ),
+    )
+
+    @staticmethod
+    def save_many(user_id, quotes):
+        """
+        Saves quote-image combinations for a user in one conditional insert,
+        skipping combinations the user already saved (unique constraint)
+
+        Args:
+            user_id (int): id of the user
+            quotes (list): dicts with quote_id, image_id, quote and author
+
+        Returns:
+            number of quotes saved
+        """
+        rows = [
+            {
+                "user_id": user_id,
+                "quote_id": quote["quote_id"],
+                "image_id": quote["image_id"],
+                "quote": quote["quote"],
+                "author": quote["author"],
+            }
+            for quote in quotes
+        ]
+        saved = insert_ignore(Quote.__table__, rows)
+        db.session.commit()
+        return saved
+
+
+class Rating(db.Model):
+    """Score (1-5) a user gave a quote; aggregated in QuoteRating"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    quote_id = db.Column(db.String(64))
+    score = db.Column(db.Integer)
+    rated_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "quote_id", name="uq_rating_user_id_quote_id"),
+    )
+
+    def __repr__(self):
+        return "<Rating {} {}>".format(self.quote_id, self.score)
+
+    @staticmethod
+    def rate(user_id, quote_id, score):
+        """
+        Stores (or changes) the rating of a user for a quote, and updates the
+        aggregate of the quote in the same transaction
+
+        Args:
+            user_id (int): id of the user
+            quote_id (str): id of the quote
+            score (int): 1 to 5
+
+        Returns:
+            QuoteRating of the quote, or None if the user rated the quote
+            concurrently
+        """
+        rating = Rating.query.filter_by(user_id=user_id, quote_id=quote_id).first()
+        if rating is None:
+            db.session.add(Rating(user_id=user_id, quote_id=quote_id, score=score))
+            added_count, added_total = 1, score
+        else:
+            added_count, added_total = 0, score - rating.score
+            rating.score = score
+            rating.rated_at = datetime.utcnow()
+
+        try:
+            db.session.flush()
+            QuoteRating.add(quote_id, added_count, added_total)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return QuoteRating.query.get(quote_id)
+
+
+class QuoteRating(db.Model):
+    """
+    Ratings of a quote, aggregated as votes are cast (no GROUP BY on reads)
+
+    bayesian_mean pulls the mean of few votes towards RATING_PRIOR_MEAN, as
+    if every quote had RATING_PRIOR_WEIGHT extra votes of that score
+    """
+
+    quote_id = db.Column(db.String(64), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    bayesian_mean = db.Column(db.Float, index=True)
+
+    def __repr__(self):
+        return "<QuoteRating {} {}>".format(self.quote_id, self.bayesian_mean)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @staticmethod
+    def add(quote_id, count, total):
+        """
+        Adds votes to the aggregate of a quote, in the current transaction
+
+        Args:
+            quote_id (str): id of the quote
+            count (int): number of votes added
+            total (int): sum of the scores added
+        """
+        prior_mean = float(current_app.config["RATING_PRIOR_MEAN"])
+        prior_weight = float(current_app.config["RATING_PRIOR_WEIGHT"])
+
+        def update():
+            # relative update, so concurrent votes are not lost
+            new_count = QuoteRating.count + count
+            new_total = QuoteRating.total + total
+            return (
+                QuoteRating.query.filter_by(quote_id=quote_id).update(
+                    {
+                        QuoteRating.count: new_count,
+                        QuoteRating.total: new_total,
+                        QuoteRating.bayesian_mean: (
+                            new_total + prior_mean * prior_weight
+                        )
+                        / (new_count + prior_weight),
+                    },
+                    synchronize_session=False,
+                )
+            )
+
+        if update():
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(
+                    QuoteRating(
+                        quote_id=quote_id,
+                        count=count,
+                        total=total,
+                        bayesian_mean=(total + prior_mean * prior_weight)
+                        / (count + prior_weight),
+                    )
+                )
+        except IntegrityError:
+            # first vote on this quote cast concurrently
+            update()
+
+
+class CorpusQuote(db.Model):
+    """Local copy of a quotable.io quote, used to serve quotes without an api call"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    quote_id = db.Column(db.String(64), index=True, unique=True)
+    quote = db.Column(db.String(1000))
+    author = db.Column(db.String(300))
+    synced_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<CorpusQuote {}>".format(self.quote_id)
+
+
+class QuoteNouns(db.Model):
+    """Nouns of a quote, stored so each quote is tagged only once"""
+
+    quote_id = db.Column(db.String(64), primary_key=True)
+    nouns = db.Column(db.Text)
+    tagger_version = db.Column(db.String(64))
+    tagged_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<QuoteNouns {}>".format(self.quote_id)
+
+
+class Image(db.Model):
+    """Compact record of an unsplash image"""
+
+    id = db.Column(db.String(64), primary_key=True)
+    url = db.Column(db.String(500))
+    colour = db.Column(db.String(16))
+    fetched_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<Image {}>".format(self.id)
+
+
+class ImageCandidate(db.Model):
+    """Image that unsplash returned when searching for a noun"""
+
+    noun = db.Column(db.String(64), primary_key=True)
+    image_id = db.Column(db.String(64), db.ForeignKey("image.id"), primary_key=True)
+    fetched_at = db.Column(db.DateTime(), default=datetime.utcnow, index=True)
+    image = db.relationship("Image")
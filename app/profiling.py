@@ -0,0 +1,347 @@
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+from app.instrumentation import collect_timings, collected_timings, stop_collecting
+
+# functions kept per dump, by cumulative time
+MAX_DUMP_FUNCTIONS = 200
+
+
+class StackSampler:
+    """
+    Samples the stacks of the registered threads every interval seconds, in
+    one background thread (started on first use)
+
+    Cheap enough to follow every request: a request only registers and
+    unregisters its thread, the sampling cost does not grow with the
+    number of requests served.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, thread_id):
+        """
+        Returns:
+            Counter of stacks (tuples of function keys, outermost first)
+            sampled since start
+        """
+        with self._lock:
+            return self._samples.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[stack_key(frame)] += 1
+
+
+def stack_key(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class RequestProfiler:
+    """
+    Profiles requests and writes a dump per profiled request to
+    PROFILE_DIR (see the `flask profile report` command):
+
+        - a sample of the requests (PROFILE_SAMPLE_RATE) with cProfile;
+          the dump has exact call counts, and a .prof file next to it
+          for pstats or snakeviz
+        - every request slower than PROFILE_SLOW_THRESHOLD (seconds) with
+          a StackSampler, as it is only known afterwards which requests
+          are slow; times are estimated from the samples
+
+    Dumps include the route, status, duration and the upstream calls (see
+    app.instrumentation.timed) of the request. Both profilers cover the
+    thread serving the request only: work on the executors shows up as
+    waiting for futures, its upstream calls are in the metadata. Disabled
+    unless a sample rate or threshold is set.
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.slow_threshold = app.config["PROFILE_SLOW_THRESHOLD"]
+        self.directory = app.config["PROFILE_DIR"]
+        self.max_dumps = app.config["PROFILE_MAX_DUMPS"]
+        self.enabled = bool(self.sample_rate or self.slow_threshold)
+        if not self.enabled:
+            return
+        self.sampler = StackSampler(app.config["PROFILE_SAMPLER_INTERVAL"])
+        self._dump_lock = threading.Lock()
+        self.logger = app.logger
+
+        @app.before_request
+        def start_profile():
+            g.profile_started = time.perf_counter()
+            if collected_timings() is None:
+                g.profile_token = collect_timings()
+            if random.random() < self.sample_rate:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # another profiler is active (python 3.12+: one per process)
+                    pass
+                else:
+                    g.profiler = profiler
+                    return
+            if self.slow_threshold:
+                self.sampler.start(threading.get_ident())
+
+        @app.after_request
+        def dump_profile(response):
+            started = g.pop("profile_started", None)
+            if started is None:
+                return response
+            duration = time.perf_counter() - started
+            profiler = g.pop("profiler", None)
+            if profiler is not None:
+                profiler.disable()
+                functions = profile_functions(pstats.Stats(profiler).stats)
+                reason = "sampled"
+            elif self.slow_threshold:
+                samples = self.sampler.stop(threading.get_ident())
+                if duration < self.slow_threshold:
+                    return response
+                functions = sample_functions(samples, self.sampler.interval)
+                reason = "slow"
+            else:
+                return response
+            metadata = request_metadata(
+                response, duration, reason, collected_timings() or []
+            )
+            metadata["slow"] = bool(
+                self.slow_threshold and duration >= self.slow_threshold
+            )
+            try:
+                self.dump(metadata, functions, profiler)
+            except OSError as error:
+                self.logger.warning(f"Writing request profile failed: {error}")
+            return response
+
+        @app.teardown_request
+        def stop_profile(exception=None):
+            # requests that failed before after_request
+            profiler = g.pop("profiler", None)
+            if profiler is not None:
+                profiler.disable()
+            elif self.slow_threshold and "profile_started" in g:
+                self.sampler.stop(threading.get_ident())
+            token = g.pop("profile_token", None)
+            if token is not None:
+                stop_collecting(token)
+
+    def dump(self, metadata, functions, profiler=None):
+        """
+        Writes a profile dump (and the pstats file of a cProfile profile),
+        removing the oldest dumps beyond PROFILE_MAX_DUMPS
+
+        Returns:
+            path of the dump
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = "-".join(
+            [
+                datetime.utcnow().strftime("%Y%m%dT%H%M%S%f"),
+                str(os.getpid()),
+                metadata["endpoint"] or "none",
+                metadata["reason"],
+            ]
+        )
+        path = os.path.join(self.directory, name + ".json")
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(self.directory, name + ".prof"))
+        with open(path, "w") as dump_file:
+            json.dump({"metadata": metadata, "functions": functions}, dump_file)
+
+        with self._dump_lock:
+            dumps = sorted(glob.glob(os.path.join(self.directory, "*.json")))
+            for old_path in dumps[: max(0, len(dumps) - self.max_dumps)]:
+                for old_file in (old_path, old_path[: -len(".json")] + ".prof"):
+                    try:
+                        os.remove(old_file)
+                    except FileNotFoundError:
+                        pass
+        return path
+
+
+profiler = RequestProfiler()
+
+
+def request_metadata(response, duration, reason, timings):
+    """
+    Returns:
+        dict with the route, status and timings of the current request,
+        the upstream calls (host, status, seconds) and seconds per stage
+    """
+    upstream, stages = [], {}
+    for stage, seconds, labels in timings:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+        if stage == "upstream":
+            call = {name: str(value) for name, value in labels.items()}
+            call["seconds"] = seconds
+            upstream.append(call)
+    return {
+        "time": datetime.utcnow().isoformat(),
+        "pid": os.getpid(),
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "duration": duration,
+        "reason": reason,
+        "upstream_calls": len(upstream),
+        "upstream_seconds": sum(call["seconds"] for call in upstream),
+        "upstream": upstream,
+        "stages": stages,
+    }
+
+
+def function_name(key):
+    filename, line, name = key
+    if filename == "~":
+        # builtins
+        return name
+    return f"{filename}:{line}({name})"
+
+
+def profile_functions(stats):
+    """
+    Args:
+        stats (dict): pstats.Stats.stats of a cProfile profile
+
+    Returns:
+        list of dicts with function, calls, self and cumulative (seconds),
+        the MAX_DUMP_FUNCTIONS functions with most cumulative time
+    """
+    functions = [
+        {
+            "function": function_name(key),
+            "calls": calls,
+            "self": self_time,
+            "cumulative": cumulative,
+        }
+        for key, (primitive_calls, calls, self_time, cumulative, callers) in stats.items()
+    ]
+    functions.sort(key=lambda function: function["cumulative"], reverse=True)
+    return functions[:MAX_DUMP_FUNCTIONS]
+
+
+def sample_functions(samples, interval):
+    """
+    Args:
+        samples (Counter): sampled stacks, see StackSampler
+        interval (float): seconds between samples
+
+    Returns:
+        list of dicts like profile_functions, with calls the number of
+        samples a function was on the stack and times estimated from them
+    """
+    self_samples, stack_samples = Counter(), Counter()
+    for stack, count in samples.items():
+        self_samples[stack[-1]] += count
+        for key in set(stack):
+            stack_samples[key] += count
+    functions = [
+        {
+            "function": function_name(key),
+            "calls": count,
+            "self": self_samples[key] * interval,
+            "cumulative": count * interval,
+        }
+        for key, count in stack_samples.items()
+    ]
+    functions.sort(key=lambda function: function["cumulative"], reverse=True)
+    return functions[:MAX_DUMP_FUNCTIONS]
+
+
+def load_profiles(directory, endpoint=None, reason=None):
+    """
+    Reads the profile dumps in directory, skipping unreadable ones
+
+    Returns:
+        list of dumps (dicts with metadata and functions), oldest first
+    """
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        try:
+            with open(path) as dump_file:
+                profile = json.load(dump_file)
+        except (OSError, ValueError):
+            continue
+        metadata = profile["metadata"]
+        if endpoint is not None and metadata["endpoint"] != endpoint:
+            continue
+        if reason is not None and metadata["reason"] != reason:
+            continue
+        profiles.append(profile)
+    return profiles
+
+
+def aggregate_profiles(profiles, sort="cumulative", limit=20):
+    """
+    Sums the functions of profile dumps up
+
+    Args:
+        profiles (list): dumps, see load_profiles
+        sort (str): "cumulative", "self" or "calls"
+        limit (int): number of functions to return
+
+    Returns:
+        list of dicts with function, calls, self, cumulative and profiles
+        (the number of dumps the function is in), top limit by sort
+    """
+    totals = {}
+    for profile in profiles:
+        for function in profile["functions"]:
+            total = totals.setdefault(
+                function["function"],
+                {
+                    "function": function["function"],
+                    "calls": 0,
+                    "self": 0.0,
+                    "cumulative": 0.0,
+                    "profiles": 0,
+                },
+            )
+            total["calls"] += function["calls"]
+            total["self"] += function["self"]
+            total["cumulative"] += function["cumulative"]
+            total["profiles"] += 1
+    return sorted(totals.values(), key=lambda total: total[sort], reverse=True)[:limit]
@@ -0,0 +1,77 @@
+"""
+Compares the noun extraction engines: agreement of the lexicon engine with
+the perceptron engine, and throughput (quotes/sec) of both
+
+Agreement is measured on the nouns per quote, taking the perceptron as
+reference: precision and recall of the lexicon nouns, the share of quotes
+with exactly the same nouns, and the share of quotes with the same top
+noun (the first image search). Uses the quotes of the local corpus, or a
+small built-in sample if the corpus is empty. Needs the lexicon of
+`flask nltk lexicon`. Run from the project root:
+
+    python -m benchmarks.engines --quotes 5000
+"""
+import argparse
+
+from app import create_app
+from app.core.quoteprocessing import Tagger, count_nouns, tokenize_quote
+from benchmarks.nouns import load_quotes, measure
+
+
+def extract_nouns(tagger, quotes):
+    return [count_nouns(tagger.tag(tokenize_quote(quote))) for quote in quotes]
+
+
+def agreement(reference, candidate):
+    """
+    Returns:
+        dict with precision, recall, exact and top_noun (fractions)
+    """
+    true_positives = predicted = relevant = exact = top_noun = 0
+    for expected_nouns, nouns in zip(reference, candidate):
+        expected = {noun for noun, frequency in expected_nouns}
+        found = {noun for noun, frequency in nouns}
+        true_positives += len(expected & found)
+        predicted += len(found)
+        relevant += len(expected)
+        exact += expected == found
+        top_noun += expected_nouns[0][0] == nouns[0][0]
+    return {
+        "precision": true_positives / predicted if predicted else 0.0,
+        "recall": true_positives / relevant if relevant else 0.0,
+        "exact": exact / len(reference),
+        "top_noun": top_noun / len(reference),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quotes", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        quotes = load_quotes(args.quotes)
+        perceptron = Tagger("perceptron")
+        lexicon = Tagger("lexicon", app.config["NOUN_LEXICON_PATH"])
+        results = []
+        for tagger in (perceptron, lexicon):
+            # keep model loading out of the measurements
+            tagger.load()
+            nouns, seconds = measure(lambda: extract_nouns(tagger, quotes))
+            results.append((tagger, nouns, seconds))
+
+    for tagger, nouns, seconds in results:
+        print(
+            f"{tagger.engine:<12} {len(quotes) / seconds:>10.0f} quotes/sec"
+            f"   (load {tagger.load_time:.3f}s)"
+        )
+    scores = agreement(results[0][1], results[1][1])
+    print(
+        "lexicon vs perceptron: "
+        + ", ".join(f"{name} {value:.1%}" for name, value in scores.items())
+    )
+
+
+if __name__ == "__main__":
+    main()
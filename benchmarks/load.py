@@ -0,0 +1,151 @@
+"""
+Load test: concurrent users requesting pages of a running quote website,
+reporting throughput and latency percentiles per path
+
+Each user is a thread with its own http session (cookies, keep-alive) that
+requests the paths in turn, with an optional think time in between. Run
+the website (e.g. with gunicorn, against benchmarks/upstream.py) and, from
+the project root:
+
+    python -m benchmarks.load --url http://localhost:5000 --users 50 --duration 60
+"""
+import argparse
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+from benchmarks.suite import percentile
+
+
+class LoadTest:
+    """
+    Args:
+        url (str): base url of the website
+        paths (list): paths every user requests in turn
+        users (int): concurrent users
+        duration (float): seconds to run
+        think_time (float): seconds a user waits between requests
+        ramp_up (float): seconds over which the users start
+        timeout (float): request timeout in seconds
+    """
+
+    def __init__(self, url, paths, users, duration, think_time=0, ramp_up=0, timeout=30):
+        self.url = url.rstrip("/")
+        self.paths = paths
+        self.users = users
+        self.duration = duration
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.timeout = timeout
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Returns:
+            seconds the test ran
+        """
+        self._stop_at = time.monotonic() + self.duration
+        threads = [
+            threading.Thread(
+                target=self._user, args=(user * self.ramp_up / self.users,), daemon=True
+            )
+            for user in range(self.users)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started
+
+    def _user(self, delay):
+        time.sleep(delay)
+        session = requests.Session()
+        request_number = 0
+        while time.monotonic() < self._stop_at:
+            path = self.paths[request_number % len(self.paths)]
+            request_number += 1
+            started = time.perf_counter()
+            try:
+                status = session.get(self.url + path, timeout=self.timeout).status_code
+            except requests.RequestException as error:
+                status = type(error).__name__
+            latency = time.perf_counter() - started
+            with self._lock:
+                self.latencies[path].append(latency)
+                self.statuses[path][status] += 1
+            if self.think_time:
+                time.sleep(self.think_time)
+
+    def report(self, seconds):
+        """
+        Returns:
+            dict path -> dict with requests, throughput, failures and
+            latency percentiles (seconds); "all" sums up all paths
+        """
+        report = {}
+        all_latencies, all_statuses = [], Counter()
+        for path in self.paths:
+            all_latencies.extend(self.latencies[path])
+            all_statuses.update(self.statuses[path])
+        for path, latencies, statuses in [
+            (path, self.latencies[path], self.statuses[path]) for path in self.paths
+        ] + [("all", all_latencies, all_statuses)]:
+            latencies = sorted(latencies)
+            if not latencies:
+                continue
+            report[path] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / seconds,
+                "failures": sum(
+                    count for status, count in statuses.items() if status != 200
+                ),
+                "statuses": dict(statuses),
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1],
+            }
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--paths", nargs="+", default=["/", "/_get_quote"])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--think-time", type=float, default=0)
+    parser.add_argument("--ramp-up", type=float, default=0)
+    args = parser.parse_args()
+
+    test = LoadTest(
+        args.url, args.paths, args.users, args.duration, args.think_time, args.ramp_up
+    )
+    seconds = test.run()
+
+    print(
+        f"{'path':<20} {'requests':>9} {'req/s':>8} {'failed':>7}"
+        f" {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    )
+    for path, result in test.report(seconds).items():
+        print(
+            f"{path:<20} {result['requests']:>9} {result['throughput']:>8.1f}"
+            f" {result['failures']:>7}"
+            + "".join(
+                f" {result[metric] * 1e3:>7.1f}ms"
+                for metric in ("p50", "p90", "p95", "p99", "max")
+            )
+        )
+        failed = {status: n for status, n in result["statuses"].items() if status != 200}
+        if failed:
+            print(f"{'':<20} failures by status: {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares noun extraction throughput (quotes/sec) of the single-quote path
+(get_nouns_from_quote) and the batch path (get_nouns_from_quotes)
+
+Uses the quotes of the local corpus, or a small built-in sample if the
+corpus is empty. Run from the project root:
+
+    python -m benchmarks.nouns --quotes 5000 --processes 4
+"""
+import argparse
+import time
+
+from app import create_app
+from app.models import CorpusQuote
+from app.core.quoteprocessing import tagger, get_nouns_from_quote, get_nouns_from_quotes
+
+SAMPLE_QUOTES = [
+    "The only way to do great work is to love what you do.",
+    "Life is what happens when you are busy making other plans.",
+    "In the middle of every difficulty lies opportunity.",
+    "The best time to plant a tree was twenty years ago. The second best time is now.",
+    "Time you enjoy wasting is not wasted time.",
+    "Love all, trust a few, do wrong to none.",
+]
+
+
+def load_quotes(count):
+    quotes = [row.quote for row in CorpusQuote.query.limit(count)] or SAMPLE_QUOTES
+    return (quotes * (count // len(quotes) + 1))[:count]
+
+
+def measure(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quotes", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        quotes = load_quotes(args.quotes)
+        # keep model loading out of the measurements
+        tagger.load()
+
+        single, single_time = measure(lambda: [get_nouns_from_quote(q) for q in quotes])
+        batch, batch_time = measure(lambda: get_nouns_from_quotes(quotes))
+        results = [("single", single_time), ("batch", batch_time)]
+        if args.processes:
+            pooled, pooled_time = measure(
+                lambda: get_nouns_from_quotes(quotes, processes=args.processes)
+            )
+            assert pooled == single, "process pool results differ from single path"
+            results.append((f"batch, {args.processes} processes", pooled_time))
+        assert batch == single, "batch results differ from single path"
+
+    for name, seconds in results:
+        print(f"{name:<24} {len(quotes) / seconds:>10.0f} quotes/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures query latency of the similar-quote index at growing corpus sizes
+
+Uses synthetic quotes: 6 to 15 terms each, drawn from a Zipf-distributed
+vocabulary, so that common terms have long postings like in real text.
+Run from the project root:
+
+    python -m benchmarks.similarity --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from app.core.similarity import SimilarityIndex
+from benchmarks.suite import percentile
+
+
+def synthetic_quotes(count, vocabulary_size, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(6, 16, size=count)
+    terms = (rng.zipf(1.3, size=int(lengths.sum())) - 1) % vocabulary_size
+    start = 0
+    for length in lengths:
+        yield Counter(f"t{term}" for term in terms[start : start + length])
+        start += length
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'quotes':>10} {'add/quote':>10} {'rebuild':>9} {'p50':>9} {'p95':>9} {'p99':>9}"
+    )
+    for size in args.sizes:
+        index = SimilarityIndex()
+        started = time.perf_counter()
+        for number, features in enumerate(synthetic_quotes(size, args.vocabulary)):
+            index.add(f"q{number}", features)
+        add_time = (time.perf_counter() - started) / size
+
+        started = time.perf_counter()
+        index.similar("q0", args.k)
+        rebuild_time = time.perf_counter() - started
+
+        rng = np.random.default_rng(1)
+        latencies = []
+        for row in rng.integers(0, size, size=args.queries):
+            started = time.perf_counter()
+            index.similar(f"q{row}", args.k)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+
+        print(
+            f"{size:>10} {add_time * 1e6:>8.1f}us {rebuild_time:>8.2f}s"
+            + "".join(
+                f" {percentile(latencies, fraction) * 1e3:>7.2f}ms"
+                for fraction in (0.5, 0.95, 0.99)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Benchmarks the quote -> image pipeline offline, against recorded quotable
+and unsplash responses (benchmarks/fixtures/upstream.json)
+
+Reports latency percentiles and peak memory (tracemalloc) per case, and
+compares them with the stored baseline (benchmarks/baseline.json): a case
+that is slower or uses more memory than the baseline plus the tolerance
+is reported as a regression and makes the run fail, as does a missing
+baseline (unless --allow-missing-baseline). Baselines depend on the
+machine, record one with --update-baseline. Run from the project root:
+
+    python -m benchmarks.suite --iterations 200
+    python -m benchmarks.suite --update-baseline
+
+--record adds live responses to the fixtures (needs network access and
+UNSPLASH_API_KEY).
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from unittest.mock import patch
+
+from sqlalchemy.pool import StaticPool
+
+from app import create_app, db
+from app.apicalls import get_api_data, fetch_quote
+from app.corpus import add_quotes_to_corpus
+from app.models import Image, ImageCandidate
+from app.core.imageprocessing import (
+    get_matching_image,
+    get_image_by_id,
+    transform_hex_to_rgb,
+    get_font_colour,
+)
+from app.core.nounstore import get_nouns_for_quote
+from app.core.quoteprocessing import tagger, get_nouns_from_quote
+from config import Config
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_PATH = os.path.join(BENCHMARKS_DIR, "fixtures", "upstream.json")
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+RANDOM_QUOTE_URL = "https://api.quotable.io/random"
+# differences below these are noise, whatever the tolerance
+MIN_LATENCY_DELTA = 0.0001
+MIN_MEMORY_DELTA_KB = 8
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": StaticPool,
+        "connect_args": {"check_same_thread": False},
+    }
+    UNSPLASH_API_KEY = "benchmark"
+    # measure the pipeline itself, not the pre-generated pairings
+    PAIRING_BUFFER_SIZE = 0
+
+
+class RecordConfig(BenchmarkConfig):
+    UNSPLASH_API_KEY = Config.UNSPLASH_API_KEY
+
+
+class FixtureResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class Upstream:
+    """
+    Replays recorded responses by url; urls with several responses cycle
+    through them, keys ending in * match by prefix
+    """
+
+    def __init__(self, responses):
+        self._responses = {url: itertools.cycle(data) for url, data in responses.items()}
+        self.calls = 0
+
+    def get_api_data(self, url, headers={}, statuses=(200,)):
+        self.calls += 1
+        responses = self._responses.get(url)
+        if responses is None:
+            for pattern, candidates in self._responses.items():
+                if fnmatch.fnmatchcase(url, pattern):
+                    responses = candidates
+                    break
+            else:
+                return None
+        return FixtureResponse(next(responses))
+
+
+class Recorder:
+    """Passes api calls on and keeps the responses, for --record"""
+
+    def __init__(self):
+        self.responses = {}
+
+    def get_api_data(self, url, headers={}, statuses=(200,)):
+        response = get_api_data(url, headers, statuses)
+        if response is not None and response.status_code == 200:
+            self.responses.setdefault(url, []).append(response.json())
+        return response
+
+
+def record_fixtures(count):
+    """
+    Runs the pipeline count times against the live apis and adds the
+    responses to the fixtures
+    """
+    app = create_app(RecordConfig)
+    recorder = Recorder()
+    with app.app_context(), patch("app.apicalls.get_api_data", recorder.get_api_data):
+        db.create_all()
+        for _ in range(count):
+            quote, author, quote_id = fetch_quote()
+            image, image_colour, image_id = get_matching_image(
+                get_nouns_for_quote(quote_id, quote)
+            )
+            get_image_by_id(image_id)
+
+    fixtures = load_fixtures()
+    fixtures.update(recorder.responses)
+    with open(FIXTURES_PATH, "w", encoding="utf-8") as fixtures_file:
+        json.dump(fixtures, fixtures_file, indent=1, ensure_ascii=False)
+    print(f"Recorded {len(recorder.responses)} url(s) to {FIXTURES_PATH}")
+
+
+def load_fixtures(path=FIXTURES_PATH):
+    with open(path, encoding="utf-8") as fixtures_file:
+        return json.load(fixtures_file)
+
+
+def make_cases(app, fixtures):
+    """
+    Returns:
+        list of tuples (name, function, setup); setup runs before every
+        call of function and is not measured
+    """
+    records = fixtures[RANDOM_QUOTE_URL]
+    quotes = itertools.cycle(record["content"] for record in records)
+    colours = itertools.cycle(
+        image["color"]
+        for url, responses in fixtures.items()
+        if "/search/photos" in url
+        for response in responses
+        for image in response["results"]
+    )
+    nouns = itertools.cycle(get_nouns_from_quote(record["content"]) for record in records)
+    client = app.test_client()
+
+    def colour():
+        image_colour = next(colours)
+        transform_hex_to_rgb(image_colour)
+        get_font_colour(image_colour)
+
+    def empty_image_index():
+        # every call searches unsplash (fixtures) and indexes the results
+        app.search_cache.clear()
+        ImageCandidate.query.delete()
+        Image.query.delete()
+        db.session.commit()
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, f"{url}: {response.status_code}"
+
+    return [
+        ("get_nouns_from_quote", lambda: get_nouns_from_quote(next(quotes)), None),
+        ("transform_hex_to_rgb+get_font_colour", colour, None),
+        ("get_matching_image", lambda: get_matching_image(next(nouns)), empty_image_index),
+        ("get_matching_image (indexed)", lambda: get_matching_image(next(nouns)), None),
+        ("index", lambda: get("/"), None),
+        ("_get_quote", lambda: get("/_get_quote"), None),
+    ]
+
+
+def run_case(function, setup, iterations):
+    latencies = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+
+    # memory in a separate pass, tracing slows the calls down
+    peak = 0
+    for _ in range(max(1, iterations // 10)):
+        if setup:
+            setup()
+        tracemalloc.start()
+        function()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "peak_kb": peak / 1024,
+    }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+        list of regression messages; cases missing from the baseline (new
+        or renamed) count as regressions, as they are not checked
+    """
+    regressions = [
+        f"{name}: not in the baseline, update it with --update-baseline"
+        for name in results
+        if name not in baseline
+    ]
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric, min_delta in (
+            ("p50", MIN_LATENCY_DELTA),
+            ("p95", MIN_LATENCY_DELTA),
+            ("peak_kb", MIN_MEMORY_DELTA_KB),
+        ):
+            limit = max(expected[metric] * (1 + tolerance), expected[metric] + min_delta)
+            if result[metric] > limit:
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:.6g} exceeds baseline "
+                    f"{expected[metric]:.6g} by more than {tolerance:.0%}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--allow-missing-baseline", action="store_true")
+    parser.add_argument("--record", action="store_true")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.iterations)
+        return
+
+    app = create_app(BenchmarkConfig)
+    fixtures = load_fixtures()
+    upstream = Upstream(fixtures)
+    results = {}
+    with app.app_context(), patch("app.apicalls.get_api_data", upstream.get_api_data):
+        db.create_all()
+        add_quotes_to_corpus(fixtures[RANDOM_QUOTE_URL])
+        # keep model loading out of the measurements
+        tagger.load()
+        for name, function, setup in make_cases(app, fixtures):
+            function()
+            results[name] = run_case(function, setup, args.iterations)
+
+    print(f"{'case':<40} {'p50':>9} {'p95':>9} {'p99':>9} {'peak':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<40}"
+            + "".join(f" {result[metric] * 1e3:>7.3f}ms" for metric in ("p50", "p95", "p99"))
+            + f" {result['peak_kb']:>8.1f}kB"
+        )
+    print(f"upstream calls (replayed): {upstream.calls}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline}, record one with --update-baseline",
+            file=sys.stderr,
+        )
+        if not args.allow_missing_baseline:
+            sys.exit(1)
+        return
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
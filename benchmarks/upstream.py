@@ -0,0 +1,196 @@
+"""
+Local stand-in for the quotable and unsplash apis, for load tests without
+the real apis (and their rate limits)
+
+Serves the endpoints used by app.apicalls from the recorded responses in
+benchmarks/fixtures/upstream.json:
+
+    quotable: /random, /quotes/<id>, /quotes?page=&limit=
+    unsplash: /search/photos?query=, /photos/<id>
+
+with injected latency, errors (500) and rate limiting (429). Point the app
+at it and run it from the project root:
+
+    QUOTABLE_API_URL=http://localhost:5001 UNSPLASH_API_URL=http://localhost:5001 flask run
+    python -m benchmarks.upstream --port 5001 --latency lognormal:80,0.5 --error-rate 0.01 --rate-limit 50
+"""
+import argparse
+import math
+import random
+import threading
+import time
+
+from flask import Flask, jsonify, request, abort
+
+from benchmarks.suite import load_fixtures, RANDOM_QUOTE_URL
+
+
+class Latency:
+    """
+    Latency distribution, parsed from "<kind>:<parameters>" (milliseconds):
+
+        fixed:50            always 50 ms
+        uniform:20,80       between 20 and 80 ms
+        exponential:50      mean 50 ms
+        lognormal:50,0.5    median 50 ms, sigma 0.5 (long tail)
+    """
+
+    def __init__(self, spec="fixed:0"):
+        kind, _, parameters = spec.partition(":")
+        self.kind = kind
+        self.parameters = [float(value) for value in parameters.split(",") if value]
+        if kind not in ("fixed", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+
+    def sample(self):
+        """
+        Returns a latency in seconds
+        """
+        if self.kind == "fixed":
+            milliseconds = self.parameters[0]
+        elif self.kind == "uniform":
+            milliseconds = random.uniform(*self.parameters)
+        elif self.kind == "exponential":
+            milliseconds = random.expovariate(1 / self.parameters[0])
+        else:
+            median, sigma = self.parameters
+            milliseconds = random.lognormvariate(math.log(median), sigma)
+        return milliseconds / 1000
+
+
+class RateLimiter:
+    """Token bucket: rate requests per second, bursts up to rate"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def create_upstream_app(
+    fixtures, latency=None, error_rate=0.0, rate_limit=None, empty_rate=0.0
+):
+    """
+    Creates the stand-in app
+
+    Args:
+        fixtures (dict): recorded responses, see benchmarks.suite
+        latency (Latency): added to every response
+        error_rate (float): fraction of requests answered with a 500
+        rate_limit (float): requests per second before answering 429
+        empty_rate (float): fraction of photo searches without results
+
+    Returns:
+        flask app, with counters of the responses in app.config["STATS"]
+    """
+    app = Flask(__name__)
+    quotes = {record["_id"]: record for record in fixtures[RANDOM_QUOTE_URL]}
+    searches = [
+        response
+        for url, responses in fixtures.items()
+        if "/search/photos" in url
+        for response in responses
+    ]
+    photos = {
+        photo["id"]: photo for response in searches for photo in response["results"]
+    }
+    latency = latency or Latency()
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    stats = app.config["STATS"] = {"requests": 0, "errors": 0, "rate_limited": 0}
+    stats_lock = threading.Lock()
+
+    def count(name):
+        with stats_lock:
+            stats[name] += 1
+
+    @app.before_request
+    def inject():
+        count("requests")
+        time.sleep(latency.sample())
+        if limiter and not limiter.allow():
+            count("rate_limited")
+            response = jsonify({"errors": ["Rate Limit Exceeded"]})
+            response.status_code = 429
+            response.headers["Retry-After"] = "1"
+            return response
+        if random.random() < error_rate:
+            count("errors")
+            abort(500)
+
+    @app.route("/random")
+    def random_quote():
+        return jsonify(random.choice(list(quotes.values())))
+
+    @app.route("/quotes/<quote_id>")
+    def quote(quote_id):
+        if quote_id not in quotes:
+            abort(404)
+        return jsonify(quotes[quote_id])
+
+    @app.route("/quotes")
+    def list_quotes():
+        page = request.args.get("page", 1, type=int)
+        limit = request.args.get("limit", 20, type=int)
+        records = list(quotes.values())
+        return jsonify(
+            {
+                "count": len(records[(page - 1) * limit : page * limit]),
+                "totalCount": len(records),
+                "page": page,
+                "totalPages": math.ceil(len(records) / limit),
+                "results": records[(page - 1) * limit : page * limit],
+            }
+        )
+
+    @app.route("/search/photos")
+    def search_photos():
+        if random.random() < empty_rate:
+            return jsonify({"total": 0, "total_pages": 0, "results": []})
+        return jsonify(random.choice(searches))
+
+    @app.route("/photos/<photo_id>")
+    def photo(photo_id):
+        if photo_id not in photos:
+            abort(404)
+        return jsonify(photos[photo_id])
+
+    @app.route("/_stats")
+    def upstream_stats():
+        return jsonify(stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", default="fixed:0", help="e.g. lognormal:80,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests/sec")
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_upstream_app(
+        load_fixtures(),
+        Latency(args.latency),
+        args.error_rate,
+        args.rate_limit,
+        args.empty_rate,
+    )
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
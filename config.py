@@ -1,20 +1,24 @@
 import os
 
 from dotenv import load_dotenv
-import nltk
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
 class Config:
-    NLTK_DATA_DIR = os.path.join(basedir, "nltk_data")
-    if not os.path.exists(NLTK_DATA_DIR):
-        os.makedirs(NLTK_DATA_DIR)
-        # Download packages and store in directory above
-        nltk.download("punkt", download_dir=NLTK_DATA_DIR)
-        nltk.download("averaged_perceptron_tagger", download_dir=NLTK_DATA_DIR)
-    nltk.data.path.append(NLTK_DATA_DIR)
-    
+    # NLTK data is provisioned with `flask nltk download`; the POS tagger is
+    # loaded on first use, or in create_app if NLTK_EAGER_LOAD is set (use
+    # with gunicorn --preload, so workers share the model copy-on-write)
+    NLTK_DATA_DIR = os.environ.get("NLTK_DATA_DIR") or os.path.join(basedir, "nltk_data")
+    NLTK_EAGER_LOAD = bool(os.environ.get("NLTK_EAGER_LOAD"))
+
+    # noun extraction engine: "perceptron" (NLTK POS tagger) or "lexicon"
+    # (noun word list built with `flask nltk lexicon`, no model at runtime)
+    NOUN_EXTRACTION_ENGINE = os.environ.get("NOUN_EXTRACTION_ENGINE") or "perceptron"
+    NOUN_LEXICON_PATH = os.environ.get("NOUN_LEXICON_PATH") or os.path.join(
+        NLTK_DATA_DIR, "noun_lexicon.txt"
+    )
+
     SECRET_KEY = os.environ.get("SECRET_KEY") or "this-is-ricks-secret"
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         "DATABASE_URL"
@@ -23,6 +27,120 @@ class Config:
 
     UNSPLASH_API_KEY = os.environ.get("UNSPLASH_API_KEY")
 
+    # base urls of the upstream apis; point both at benchmarks/upstream.py
+    # to run without the real apis
+    QUOTABLE_API_URL = os.environ.get("QUOTABLE_API_URL") or "https://api.quotable.io"
+    UNSPLASH_API_URL = os.environ.get("UNSPLASH_API_URL") or "https://api.unsplash.com"
+
+    # in-process LRU in front of the stored nouns per quote
+    NOUN_CACHE_SIZE = 4096
+
+    # saved quotes per page of the quote-drawer
+    QUOTES_PER_PAGE = 25
+    # maximum number of quotes saved in one bulk request
+    SAVE_BULK_MAX = 100
+
+    # per-process cache of logged in users (ttl in seconds); bounds how long
+    # a change made by another process can go unnoticed
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60
+
+    # last_seen of users is written in bulk every LAST_SEEN_FLUSH_INTERVAL
+    # seconds, with a resolution of LAST_SEEN_GRANULARITY seconds
+    LAST_SEEN_FLUSH_INTERVAL = 60
+    LAST_SEEN_GRANULARITY = 60
+
+    # pooled http session for api calls: hosts to keep pools for, connections
+    # per host (a hard limit, further calls wait for a free connection; keep
+    # it near EXECUTOR_WORKERS + PAIRING_WORKERS) and connect/read timeouts
+    # (seconds)
+    HTTP_POOL_CONNECTIONS = 4
+    HTTP_POOL_MAXSIZE = 10
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT") or 3.05)
+    HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT") or 5)
+
+    # thread pool for concurrent api calls, and the number of top nouns
+    # get_matching_image searches concurrently (1: one noun at a time)
+    EXECUTOR_WORKERS = int(os.environ.get("EXECUTOR_WORKERS") or 8)
+    IMAGE_SEARCH_FANOUT = int(os.environ.get("IMAGE_SEARCH_FANOUT") or 3)
+
+    # local quote corpus: page size of the bulk sync, how often (seconds)
+    # each process reloads its list of corpus ids for random sampling, and
+    # the corpus size below which random quotes come from the api instead
+    QUOTE_CORPUS_PAGE_SIZE = 150
+    QUOTE_CORPUS_REFRESH = 300
+    QUOTE_CORPUS_MIN_SIZE = int(os.environ.get("QUOTE_CORPUS_MIN_SIZE") or 100)
+
+    # quote ratings: the bayesian mean counts RATING_PRIOR_WEIGHT extra votes
+    # of RATING_PRIOR_MEAN; random quotes are drawn in proportion to
+    # bayesian_mean ** RATED_QUOTE_SAMPLING_EXPONENT (0 is uniform)
+    RATING_PRIOR_MEAN = 3.0
+    RATING_PRIOR_WEIGHT = 5
+    RATED_QUOTE_SAMPLING = True
+    RATED_QUOTE_SAMPLING_EXPONENT = 2
+
+    # similar quotes: how often (seconds) each process adds new corpus quotes
+    # to its similarity index, how often at most a request for a quote that
+    # is not indexed triggers that early, and the maximum number of quotes
+    # per request
+    SIMILARITY_REFRESH = 300
+    SIMILARITY_FORCE_INTERVAL = 60
+    SIMILAR_QUOTES_MAX = 20
+
+    # cache of unsplash search results per noun; nouns without images are
+    # cached as well, for a shorter time
+    UNSPLASH_SEARCH_CACHE_SIZE = 2048
+    UNSPLASH_SEARCH_CACHE_TTL = 6 * 60 * 60
+    UNSPLASH_SEARCH_CACHE_NEGATIVE_TTL = 60 * 60
+
+    # local noun -> image index: indexed images older than this (days) are
+    # searched again by `flask images refresh`
+    IMAGE_INDEX_MAX_AGE = 30
+
+    # quote and image records of permalink views: in-process cache (size,
+    # ttl in seconds) in front of the database, and days after which a stored
+    # image record is fetched again
+    METADATA_CACHE_SIZE = 4096
+    METADATA_CACHE_TTL = 24 * 60 * 60
+    METADATA_MAX_AGE = 30
+
+    # rendered permalink pages: cache budget (bytes) and ttl (seconds), and
+    # max-age of the Cache-Control header sent to browsers and crawlers
+    PAGE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    PAGE_CACHE_TTL = 24 * 60 * 60
+    PAGE_CACHE_MAX_AGE = 60 * 60
+
+    # buffer of pre-generated quote/image pairings for the quote views:
+    # capacity (0 disables), refill mark and maximum pairings per second
+    PAIRING_BUFFER_SIZE = int(os.environ.get("PAIRING_BUFFER_SIZE") or 20)
+    PAIRING_BUFFER_LOW_WATER = 10
+    PAIRING_BUFFER_MAX_RATE = 2
+
+    # slideshow batches: threads building pairings concurrently, and the
+    # maximum number of pairings per batch
+    PAIRING_WORKERS = 4
+    QUOTE_BATCH_MAX = 10
+
+    # shared slideshow channel: seconds between slides, slides a subscriber
+    # may lag behind before it is dropped, and seconds between keep-alives
+    CHANNEL_INTERVAL = 10
+    CHANNEL_QUEUE_SIZE = 5
+    CHANNEL_KEEPALIVE = 15
+
+    # per-stage timings in Server-Timing headers and histograms at /metrics
+    INSTRUMENTATION_ENABLED = bool(os.environ.get("INSTRUMENTATION_ENABLED"))
+    # bearer token required for /metrics and /_metrics, unset hides them
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # request profiling, see app.profiling: a fraction of the requests with
+    # cProfile, and every request slower than the threshold (seconds) with
+    # a stack sampler; 0 disables either. Report with `flask profile report`
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE") or 0)
+    PROFILE_SLOW_THRESHOLD = float(os.environ.get("PROFILE_SLOW_THRESHOLD") or 0)
+    PROFILE_SAMPLER_INTERVAL = 0.005
+    PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(basedir, "logs", "profiles")
+    PROFILE_MAX_DUMPS = 1000
+
     STANDARD_IMAGE = (
         "https://images.unsplash.com/photo-1549619856-ac562a3ed1a3?ixlib=rb-1.2.1&q=80&fm=jpg&crop=entropy&cs=tinysrgb&w=1080&fit=max&ixid=eyJhcHBfaWQiOjk4NzE0fQ",
         "#DEE1E5",
@@ -0,0 +1,32 @@
+"""added unique constraint to quote table
+
+Revision ID: 89788ef4917b
+Revises: 19ed32fe9f74
+Create Date: 2026-10-18 02:34:00.641024
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '89788ef4917b'
+down_revision = '19ed32fe9f74'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # remove duplicates saved before the constraint existed, keep the oldest;
+    # the derived table lets MySQL delete from the table it selects from
+    op.execute(
+        "DELETE FROM quote WHERE id NOT IN (SELECT id FROM "
+        "(SELECT MIN(id) AS id FROM quote GROUP BY user_id, quote_id, image_id) AS keep)"
+    )
+    # batch mode, as SQLite cannot add constraints to an existing table
+    with op.batch_alter_table('quote') as batch_op:
+        batch_op.create_unique_constraint('uq_quote_user_id_quote_id_image_id', ['user_id', 'quote_id', 'image_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('quote') as batch_op:
+        batch_op.drop_constraint('uq_quote_user_id_quote_id_image_id', type_='unique')
@@ -1 +1,4 @@
-from app import app
\ No newline at end of file
+from app import create_app, cli
+
+app = create_app()
+cli.register(app)
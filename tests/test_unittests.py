@@ -1,32 +1,83 @@
 import os
+import tempfile
+import threading
+import time
+from datetime import datetime
 
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from nose2.tools import params
-from flask import appcontext_pushed, g
 
-from app import create_app, db
-from config import basedir
+from sqlalchemy.pool import StaticPool
 
-from app.models import User, Quote
+from app import create_app, db, login
+from config import Config
 
-from app.core.quoteprocessing import get_nouns_from_quote
+from app.models import load_user, UserSnapshot, User, Quote, CorpusQuote, QuoteNouns, Image, ImageCandidate, Rating, QuoteRating
+
+from requests import Timeout
+from sqlalchemy.exc import OperationalError
+
+from app.apicalls import (
+    api_url,
+    get_api_data,
+    get_quote,
+    search_image_from_unsplash,
+    QuoteUnavailable,
+)
+from app.activity import LastSeenTracker
+from app.cache import TTLCache
+from app.corpus import add_quotes_to_corpus, FenwickTree, QuoteSampler
+
+from app.core.quoteprocessing import (
+    get_nouns_from_quote,
+    get_nouns_from_quotes,
+    Tagger,
+    tagger,
+    count_nouns,
+)
 
 from app.core.imageprocessing import (
     get_matching_image,
     transform_hex_to_rgb,
     get_perceived_brightness,
     get_image_by_id,
+    get_image_by_id_async,
+)
+
+from app.core.nounstore import get_nouns_for_quote, warm_noun_store
+from app.core.pairing import PairingBuffer
+from app.core.channel import Channel
+from app.core.lexicon import LexiconTagger, build_lexicon, save_lexicon
+from app.core.similarity import (
+    SimilarityIndex,
+    CorpusSimilarityIndex,
+    get_quote_features,
 )
+from app.core.routes import is_valid_request, get_saved_quotes
+from app.executor import submit
+from app.instrumentation import timed, server_timing
+from app.profiling import load_profiles, aggregate_profiles, sample_functions
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    # one shared in-memory database, also for worker threads
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": StaticPool,
+        "connect_args": {"check_same_thread": False},
+    }
+    PAIRING_BUFFER_SIZE = 0
 
-from app.core.routes import is_valid_request
 
 """
 For some patching we need to setup and application context
 """
-app = create_app()
+app = create_app(TestConfig)
 app.app_context().push()
+db.create_all()
 
 
 class TestNounParser(unittest.TestCase):
@@ -67,9 +118,156 @@ class TestNounParser(unittest.TestCase):
         self.assertTrue("Quote must be at least of length 1" in error.exception.args)
 
 
+class TestBatchNounParser(unittest.TestCase):
+    """Tests batch noun parser"""
+
+    def fake_tag(tokens):
+        return [(token, "NN" if token in ("tree", "car", "quote") else "DT") for token in tokens]
+
+    quotes = ["This is a quote", "The tree and the car and the other car", "The is"]
+
+    @patch("app.core.quoteprocessing.tagger.load")
+    def test_same_as_single_quote(self, patched_function):
+        """Batch returns exactly the result of the single-quote function"""
+        patched_function.return_value.tag.side_effect = TestBatchNounParser.fake_tag
+        result = get_nouns_from_quotes(self.quotes)
+        expected = [get_nouns_from_quote(quote) for quote in self.quotes]
+        self.assertEqual(result, expected)
+        self.assertEqual(result[2], [("wisdom", 1)])
+
+    @params(None, 0)
+    def test_batch_input_other_than_string(self, input):
+        """TypeError raised if one of the quotes is not a string"""
+        with self.assertRaises(TypeError) as error:
+            get_nouns_from_quotes(["This is a quote", input])
+        self.assertTrue("Quote must be of type str" in error.exception.args)
+
+
+@patch("app.core.nounstore.get_nouns_from_quote", return_value=[("quote", 1)])
+class TestNounStore(unittest.TestCase):
+    """Tests stored nouns per quote id"""
+
+    def tearDown(self):
+        QuoteNouns.query.delete()
+        db.session.commit()
+        app.noun_cache.clear()
+
+    def test_tagged_once(self, patched_function):
+        """Quote is tagged once, also when the in-process cache is cleared"""
+        get_nouns_for_quote("q1", "This is a quote")
+        app.noun_cache.clear()
+        result = get_nouns_for_quote("q1", "This is a quote")
+        self.assertEqual(result, [("quote", 1)])
+        self.assertEqual(patched_function.call_count, 1)
+
+    def test_tagger_version_change(self, patched_function):
+        """Nouns of another tagger version are tagged again"""
+        get_nouns_for_quote("q1", "This is a quote")
+        with patch.object(Tagger, "version", "other-version"):
+            get_nouns_for_quote("q1", "This is a quote")
+        self.assertEqual(patched_function.call_count, 2)
+        self.assertEqual(QuoteNouns.query.get("q1").tagger_version, "other-version")
+
+    @patch("app.core.nounstore.get_nouns_from_quotes", return_value=[[("tree", 1)]])
+    def test_warm_store(self, patched_batch, patched_function):
+        """Warming only tags quotes without stored nouns"""
+        get_nouns_for_quote("q1", "This is a quote")
+        result = warm_noun_store([("q1", "This is a quote"), ("q2", "A tree")])
+        self.assertEqual(result, 1)
+        self.assertEqual(get_nouns_for_quote("q2", "A tree"), [("tree", 1)])
+
+
+class TestTagger(unittest.TestCase):
+    """Tests loading of the POS tagger"""
+
+    @patch("app.core.quoteprocessing.PerceptronTagger")
+    def test_lazy_load(self, patched_class):
+        """Model is loaded once, on first use"""
+        tagger = Tagger()
+        tagger.init_app(app)
+        self.assertFalse(tagger.loaded)
+        tagger.tag(["a", "quote"])
+        tagger.tag(["another", "quote"])
+        self.assertEqual(patched_class.call_count, 1)
+        self.assertIsNotNone(tagger.stats()["load_time"])
+
+    @patch("app.core.quoteprocessing.gc")
+    @patch("app.core.quoteprocessing.PerceptronTagger")
+    def test_eager_load(self, patched_class, patched_gc):
+        """Model is loaded by init_app if NLTK_EAGER_LOAD is set"""
+        tagger = Tagger()
+        with patch.dict(app.config, {"NLTK_EAGER_LOAD": True}):
+            tagger.init_app(app)
+        self.assertTrue(tagger.loaded)
+
+
+class TestLexiconEngine(unittest.TestCase):
+    """Tests lexicon noun extraction engine"""
+
+    lexicon = LexiconTagger(
+        nouns=["life", "heart"],
+        likely_nouns=["love", "hope"],
+        others=["is", "the", "we", "to"],
+        suffixes=["ion"],
+    )
+
+    @params(
+        ("life is love.", ["NN", "X", "NN"]),
+        ("we love to hope", ["X", "X", "X", "X"]),
+        ("the zeitgeist is imagination", ["X", "NN", "X", "NN"]),
+        ("1984 is", ["X", "X"]),
+    )
+    def test_tag(self, quote, expected):
+        """Lexicon classes and context rules decide the noun tags"""
+        result = [tag for token, tag in self.lexicon.tag(quote.split(" "))]
+        self.assertEqual(result, expected)
+
+    def test_build_lexicon(self):
+        """Words are classified from the tag dictionary and word weights"""
+
+        class Model:
+            weights = {
+                "i word love": {"NN": 1.0, "VB": 0.5},
+                "i word run": {"NN": 0.2, "VB": 0.9},
+                "i word life": {"VB": 1.0},
+                "i suffix ion": {"NN": 2.0},
+                "i-1 word the": {"NN": 3.0},
+            }
+
+        class Perceptron:
+            tagdict = {"Life": "NN", "the": "DT"}
+            model = Model()
+
+        result = build_lexicon(Perceptron())
+        self.assertEqual(
+            result, {"N": ["life"], "A": ["love"], "O": ["run", "the"], "S": ["ion"]}
+        )
+
+    def test_engine(self):
+        """Lexicon engine loads the saved lexicon and keeps the output format"""
+        tagger = Tagger()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "lexicon.txt")
+            save_lexicon({"N": ["life"], "A": ["love"], "S": ["ion"]}, path, "test")
+            tagger.configure("lexicon", path)
+            self.assertEqual(tagger.version, "lexicon1-test")
+            tagged = tagger.tag_sents([["life", "is", "love", "life."]])
+        self.assertEqual(count_nouns(tagged[0]), [("life", 1), ("life.", 1), ("love", 1)])
+
+    def test_unknown_engine(self):
+        """Unknown engine is refused"""
+        with self.assertRaises(ValueError):
+            Tagger().configure("magic")
+
+
 class TestImageSelecter(unittest.TestCase):
     """Tests image selecter"""
 
+    def tearDown(self):
+        ImageCandidate.query.delete()
+        Image.query.delete()
+        db.session.commit()
+
     @patch("app.core.imageprocessing.search_image_from_unsplash", return_value=None)
     def test_no_image(self, patched_function):
         result = get_matching_image([("test", 0)])
@@ -92,6 +290,59 @@ class TestImageSelecter(unittest.TestCase):
         expected = ("regular_url", "black", "my_id")
         self.assertEqual(result, expected)
 
+    def test_fanout_prefers_best_ranked_noun(self):
+        """Of the concurrently searched nouns, the best ranked with images wins"""
+
+        def search(noun):
+            if noun == "first":
+                return None
+            return [{"color": "black", "id": noun, "urls": {"regular": noun}}]
+
+        with patch(
+            "app.core.imageprocessing.search_image_from_unsplash", side_effect=search
+        ):
+            result = get_matching_image([("first", 2), ("second", 1), ("third", 1)])
+        expected = ("second", "black", "second")
+        self.assertEqual(result, expected)
+
+    def test_fanout_falls_back_to_remaining_nouns(self):
+        """Nouns after the top IMAGE_SEARCH_FANOUT are searched if needed"""
+        nouns = [(f"noun{i}", 1) for i in range(app.config["IMAGE_SEARCH_FANOUT"])]
+        nouns.append(("last", 1))
+
+        def search(noun):
+            if noun == "last":
+                return [{"color": "black", "id": "my_id", "urls": {"regular": "url"}}]
+            return None
+
+        with patch(
+            "app.core.imageprocessing.search_image_from_unsplash", side_effect=search
+        ) as patched_function:
+            result = get_matching_image(nouns)
+        self.assertEqual(result, ("url", "black", "my_id"))
+        self.assertEqual(patched_function.call_count, len(nouns))
+
+    @patch(
+        "app.core.imageprocessing.search_image_from_unsplash",
+        return_value=[{"color": "black", "id": "my_id", "urls": {"regular": "url"}}],
+    )
+    def test_found_image_is_indexed(self, patched_function):
+        """Second quote with the same noun is served from the local index"""
+        get_matching_image([("test", 1)])
+        result = get_matching_image([("test", 1)])
+        self.assertEqual(result, ("url", "black", "my_id"))
+        self.assertEqual(patched_function.call_count, 1)
+
+    @patch("app.core.imageprocessing.search_image_from_unsplash", return_value=None)
+    def test_indexed_noun_preferred(self, patched_function):
+        """Any indexed noun avoids the api, best ranked indexed noun first"""
+        db.session.add(Image(id="my_id", url="url", colour="black"))
+        db.session.add(ImageCandidate(noun="second", image_id="my_id"))
+        db.session.commit()
+        result = get_matching_image([("first", 2), ("second", 1)])
+        self.assertEqual(result, ("url", "black", "my_id"))
+        patched_function.assert_not_called()
+
     @params(0, None, {"test": "dict"}, "b")
     def test_imageselecter_input_other_than_string(self, input):
         """TypeError raised if input not liust"""
@@ -115,12 +366,19 @@ class TestImageById(unittest.TestCase):
     class MockResponse:
         """Small helper class to mock response data"""
 
+        status_code = 200
+
         def __init__(self, json_data):
             self.json_data = json_data
 
         def json(self):
             return self.json_data
 
+    def tearDown(self):
+        Image.query.delete()
+        db.session.commit()
+        app.metadata_cache.clear()
+
     @patch("app.core.imageprocessing.get_image_from_unsplash_api", return_value=None)
     def test_no_image(self, patched_function):
         result = get_image_by_id("fake")
@@ -143,6 +401,151 @@ class TestImageById(unittest.TestCase):
         expected = ("regular_url", "black", "my_id")
         self.assertEqual(result, expected)
 
+    def test_record_survives_restart(self):
+        """Image record is stored, so a new process does not call the api"""
+        with patch(
+            "app.core.imageprocessing.get_image_from_unsplash_api",
+            return_value=self.MockResponse(
+                {"color": "black", "id": "my_id", "urls": {"regular": "regular_url"}}
+            ),
+        ):
+            get_image_by_id("my_id")
+        app.metadata_cache.clear()
+        with patch(
+            "app.core.imageprocessing.get_image_from_unsplash_api"
+        ) as patched_function:
+            result = get_image_by_id("my_id")
+        self.assertEqual(result, ("regular_url", "black", "my_id"))
+        patched_function.assert_not_called()
+
+    def test_concurrent_lookups_share_one_call(self):
+        """A burst of identical cold lookups makes one api call"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_api(endpoint):
+            started.set()
+            release.wait(2)
+            return self.MockResponse(
+                {"color": "black", "id": "my_id", "urls": {"regular": "regular_url"}}
+            )
+
+        with patch(
+            "app.core.imageprocessing.get_image_from_unsplash_api",
+            side_effect=slow_api,
+        ) as patched_function:
+            leader = get_image_by_id_async("my_id")
+            started.wait(2)
+            followers = [get_image_by_id_async("my_id") for _ in range(3)]
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in [leader] + followers]
+        self.assertEqual(patched_function.call_count, 1)
+        self.assertEqual(set(results), {("regular_url", "black", "my_id")})
+
+
+class TestTTLCache(unittest.TestCase):
+    """Tests in-process cache"""
+
+    def test_lru_eviction(self):
+        """Least recently used entry is evicted first"""
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+
+    def test_expiry(self):
+        """Expired entries are misses"""
+        cache = TTLCache(ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+
+    def test_weighted_eviction(self):
+        """With weigh, maxsize bounds the total weight"""
+        cache = TTLCache(maxsize=10, weigh=len)
+        cache.set("a", b"12345")
+        cache.set("b", b"123456")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["weight"], 6)
+
+
+class TestApiData(unittest.TestCase):
+    """Tests api calls through the pooled session"""
+
+    @patch.object(app.http_session, "get", side_effect=Timeout())
+    def test_timeout(self, patched_function):
+        """Timeouts are handled as unsuccesful calls"""
+        result = get_api_data("https://api.quotable.io/random")
+        self.assertIsNone(result)
+        self.assertEqual(
+            patched_function.call_args[1]["timeout"],
+            (app.config["HTTP_CONNECT_TIMEOUT"], app.config["HTTP_READ_TIMEOUT"]),
+        )
+
+    def test_pool_limits_connections(self):
+        """Connections per host are capped, extra calls wait for one"""
+        adapter = app.http_session.get_adapter("https://api.quotable.io")
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(adapter._pool_maxsize, app.config["HTTP_POOL_MAXSIZE"])
+
+    @params(
+        ("http://localhost:5001", "/photos/x"),
+        ("http://localhost:5001/", "photos/x"),
+        ("http://localhost:5001/", "/photos/x"),
+    )
+    def test_api_url(self, base, endpoint):
+        """Base url and endpoint are joined with one slash"""
+        self.assertEqual(api_url(base, endpoint), "http://localhost:5001/photos/x")
+
+    @patch("app.apicalls.get_api_data", return_value=None)
+    def test_configured_base_url(self, patched_function):
+        """Api calls go to the configured base url"""
+        with patch.dict(app.config, {"UNSPLASH_API_URL": "http://localhost:5001"}):
+            get_image_by_id("stand_in_id")
+        self.assertEqual(
+            patched_function.call_args[0][0], "http://localhost:5001/photos/stand_in_id"
+        )
+
+
+class TestSearchCache(unittest.TestCase):
+    """Tests caching of unsplash searches"""
+
+    def tearDown(self):
+        app.search_cache.clear()
+
+    @patch(
+        "app.apicalls.get_image_from_unsplash_api",
+        return_value=TestImageById.MockResponse({"total": 1, "results": ["image"]}),
+    )
+    def test_results_cached(self, patched_function):
+        """Second search for a noun is served from cache"""
+        search_image_from_unsplash("tree")
+        result = search_image_from_unsplash("tree")
+        self.assertEqual(result, ["image"])
+        self.assertEqual(patched_function.call_count, 1)
+
+    @patch(
+        "app.apicalls.get_image_from_unsplash_api",
+        return_value=TestImageById.MockResponse({"total": 0, "results": []}),
+    )
+    def test_no_results_cached(self, patched_function):
+        """Nouns without images are cached as well"""
+        search_image_from_unsplash("nothing")
+        result = search_image_from_unsplash("nothing")
+        self.assertIsNone(result)
+        self.assertEqual(patched_function.call_count, 1)
+
+    @patch("app.apicalls.get_image_from_unsplash_api", return_value=None)
+    def test_failure_not_cached(self, patched_function):
+        """Failed api calls are retried"""
+        search_image_from_unsplash("tree")
+        search_image_from_unsplash("tree")
+        self.assertEqual(patched_function.call_count, 2)
+
 
 class TestHexToRGB(unittest.TestCase):
     """Tests Hex to RGB converter"""
@@ -189,6 +592,867 @@ class TestPerceivedBrighness(unittest.TestCase):
         expected = 0
         self.assertEqual(result, expected)
 
+class TestQuoteCorpus(unittest.TestCase):
+    """Tests local quote corpus"""
+
+    records = [
+        {"_id": "q1", "content": "First quote", "author": "Author one"},
+        {"_id": "q2", "content": "Second quote", "author": "Author two"},
+    ]
+
+    def setUp(self):
+        add_quotes_to_corpus(self.records)
+
+    def tearDown(self):
+        CorpusQuote.query.delete()
+        db.session.commit()
+        app.quote_sampler.invalidate()
+        app.metadata_cache.clear()
+
+    def test_known_quotes_are_skipped(self):
+        """Syncing the same quotes twice adds nothing"""
+        result = add_quotes_to_corpus(self.records)
+        self.assertEqual(result, 0)
+        self.assertEqual(CorpusQuote.query.count(), 2)
+
+    def test_new_quotes_appended_to_sampler(self):
+        """New quotes are appended to the loaded sampler, without a reload"""
+        sampler = app.quote_sampler
+        with patch.object(sampler, "weighted", True):
+            sampler.ids()
+            with patch.object(sampler, "_load", side_effect=AssertionError("reload")):
+                add_quotes_to_corpus(
+                    [{"_id": "q3", "content": "Third quote", "author": "Author three"}]
+                )
+                ids = sampler.ids()
+            q3 = CorpusQuote.query.filter_by(quote_id="q3").first()
+            self.assertEqual(ids[-1], q3.id)
+            self.assertEqual(len(sampler._weights), 3)
+            self.assertAlmostEqual(sampler._weights.total(), 3 * sampler.weight(None))
+
+    def test_concurrently_added_quote_skipped(self):
+        """A quote added by another worker meanwhile does not fail the batch"""
+        records = self.records + [
+            {"_id": "q3", "content": "Third quote", "author": "Author three"}
+        ]
+        # the other worker adds q1 after the known quotes were looked up
+        with patch.object(db.session, "query") as patched_query:
+            patched_query.return_value.filter.return_value = []
+            result = add_quotes_to_corpus(records)
+        self.assertEqual(result, 1)
+        self.assertEqual(CorpusQuote.query.count(), 3)
+        self.assertIsNotNone(CorpusQuote.query.filter_by(quote_id="q3").first().synced_at)
+
+    @patch("app.apicalls.get_api_data", side_effect=AssertionError("api called"))
+    @patch.object(app.quote_sampler, "min_size", 2)
+    def test_random_quote_from_corpus(self, patched_function):
+        """Random quote is drawn from the corpus, without api call"""
+        result = get_quote()
+        self.assertIn(result, [("First quote", "Author one", "q1"), ("Second quote", "Author two", "q2")])
+
+    @patch("app.apicalls.get_api_data", side_effect=AssertionError("api called"))
+    def test_permalink_quote_from_corpus(self, patched_function):
+        """Quote by id is served from the corpus, without api call"""
+        result = get_quote("quotes/q2")
+        expected = ("Second quote", "Author two", "q2")
+        self.assertEqual(result, expected)
+
+    @patch(
+        "app.apicalls.get_api_data",
+        return_value=TestImageById.MockResponse(
+            {"_id": "q3", "content": "Third quote", "author": "Author three"}
+        ),
+    )
+    def test_random_quote_not_added_to_corpus(self, patched_function):
+        """With an empty corpus every random quote comes from the api"""
+        CorpusQuote.query.delete()
+        db.session.commit()
+        app.quote_sampler.invalidate()
+        for _ in range(3):
+            get_quote()
+        self.assertEqual(patched_function.call_count, 3)
+        self.assertEqual(CorpusQuote.query.count(), 0)
+
+    @patch(
+        "app.apicalls.get_api_data",
+        return_value=TestImageById.MockResponse(
+            {"_id": "q3", "content": "Third quote", "author": "Author three"}
+        ),
+    )
+    def test_permalink_quote_added_to_corpus(self, patched_function):
+        """Quote fetched from the api is stored in the corpus"""
+        get_quote("quotes/q3")
+        app.metadata_cache.clear()
+        result = get_quote("quotes/q3")
+        self.assertEqual(result, ("Third quote", "Author three", "q3"))
+        self.assertEqual(patched_function.call_count, 1)
+
+    @patch(
+        "app.apicalls.get_api_data",
+        return_value=TestImageById.MockResponse(
+            {"_id": "q3", "content": "Third quote", "author": "Author three"}
+        ),
+    )
+    def test_unsynced_corpus_not_sampled(self, patched_function):
+        """Random quotes come from the api until the corpus has min_size quotes"""
+        get_quote("quotes/q3")
+        for _ in range(3):
+            get_quote()
+        self.assertEqual(patched_function.call_count, 4)
+
+
+class TestPairingBuffer(unittest.TestCase):
+    """Tests buffer of pre-generated pairings"""
+
+    pairing = {
+        "image": "regular_url",
+        "image_id": "my_id",
+        "quote_id": "q1",
+        "quote": "First quote",
+        "author": "Author one",
+        "image_colour_r": 0,
+        "image_colour_g": 0,
+        "image_colour_b": 0,
+        "font_colour": "#FFFFFF",
+    }
+
+    @patch("app.core.pairing.make_pairing")
+    def test_buffer_refills(self, patched_function):
+        """Producer fills the buffer, after which pop is served from memory"""
+        patched_function.return_value = self.pairing
+        buffer = PairingBuffer(app, size=2, low_water=1, max_rate=0)
+        buffer.pop()
+        for _ in range(100):
+            if buffer.stats()["depth"] == 2:
+                break
+            time.sleep(0.01)
+        result = buffer.pop()
+        self.assertEqual(result, self.pairing)
+        self.assertEqual(buffer.stats()["hits"], 1)
+
+    def test_disabled_buffer(self):
+        """Buffer of size 0 never returns a pairing"""
+        buffer = PairingBuffer(app, size=0, low_water=0, max_rate=0)
+        self.assertIsNone(buffer.pop())
+        self.assertEqual(buffer.stats()["produced"], 0)
+
+    @patch("app.core.routes.make_pairing")
+    def test_get_quote_endpoint(self, patched_function):
+        """Slideshow endpoint falls back to generating a pairing"""
+        patched_function.return_value = self.pairing
+        with app.test_client() as client:
+            result = client.get("/_get_quote").get_json()
+        self.assertEqual(result["quote_id"], "q1")
+        self.assertTrue(result["url"].endswith("/q1/my_id"))
+
+
+class TestChannel(unittest.TestCase):
+    """Tests shared slideshow channel"""
+
+    pairing = TestPairingBuffer.pairing
+
+    def test_publish(self):
+        """Every subscriber gets the published pairing"""
+        channel = Channel(app, interval=60, queue_size=2)
+        channel._ticker = threading.current_thread()
+        subscriptions = [channel.subscribe() for _ in range(3)]
+        channel.publish(self.pairing)
+        for subscription in subscriptions:
+            self.assertEqual(subscription.get_nowait(), self.pairing)
+        self.assertEqual(channel.stats()["delivered"], 3)
+        self.assertEqual(channel.stats()["connections"], 3)
+
+    def test_slow_subscriber_dropped(self):
+        """Subscriber with a full queue is dropped, the others still get it"""
+        channel = Channel(app, interval=60, queue_size=1)
+        channel._ticker = threading.current_thread()
+        slow = channel.subscribe()
+        channel.publish(self.pairing)
+        fast = channel.subscribe()
+        fast.get_nowait()
+        channel.publish(self.pairing)
+        self.assertFalse(channel.is_subscribed(slow))
+        self.assertEqual(fast.get_nowait(), self.pairing)
+        self.assertEqual(channel.stats()["dropped"], 1)
+        self.assertEqual(list(channel.listen(slow, keepalive=0)), [])
+
+    @patch("app.core.channel.make_pairing")
+    def test_channel_endpoint(self, patched_function):
+        """Stream sends the payloads of the ticker as events"""
+        patched_function.return_value = self.pairing
+        with app.test_client() as client:
+            response = client.get("/_channel")
+            event = next(response.response)
+            response.close()
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertTrue(event.startswith(b"data: "))
+        self.assertIn(b"/q1/my_id", event)
+        self.assertEqual(app.channel.stats()["connections"], 0)
+
+
+class TestQuoteBatch(unittest.TestCase):
+    """Tests slideshow batch endpoint"""
+
+    @patch("app.core.routes.make_pairing", return_value=TestPairingBuffer.pairing)
+    def test_batch(self, patched_function):
+        """Batch returns the requested number of payloads"""
+        with app.test_client() as client:
+            result = client.get("/_get_quotes?count=3").get_json()
+        self.assertEqual(len(result["quotes"]), 3)
+        self.assertTrue(result["quotes"][0]["url"].endswith("/q1/my_id"))
+        self.assertEqual(patched_function.call_count, 3)
+
+    @patch("app.core.routes.make_pairing", return_value=TestPairingBuffer.pairing)
+    def test_batch_size_bounded(self, patched_function):
+        """Batch size is capped at QUOTE_BATCH_MAX"""
+        with app.test_client() as client:
+            result = client.get("/_get_quotes?count=1000").get_json()
+        self.assertEqual(len(result["quotes"]), app.config["QUOTE_BATCH_MAX"])
+
+
+class TestPermalink(unittest.TestCase):
+    """Tests social media (permalink) view"""
+
+    def tearDown(self):
+        app.page_cache.clear()
+
+    def test_quote_and_image_fetched_concurrently(self):
+        """Quote and image calls overlap, both wait for each other"""
+        barrier = threading.Barrier(2, timeout=2)
+
+        def quote(endpoint):
+            barrier.wait()
+            return "First quote", "Author one", "q1"
+
+        def image(id):
+            barrier.wait()
+            return "regular_url", "#000000", "my_id"
+
+        with patch("app.apicalls.get_quote", side_effect=quote), patch(
+            "app.core.imageprocessing.get_image_by_id", side_effect=image
+        ):
+            with app.test_client() as client:
+                response = client.get("/q1/my_id")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"First quote", response.data)
+
+    @patch("app.apicalls.get_quote", return_value=("First quote", "Author one", "q1"))
+    @patch(
+        "app.core.imageprocessing.get_image_by_id",
+        return_value=("regular_url", "#000000", "my_id"),
+    )
+    def test_rendered_page_cached(self, patched_image, patched_quote):
+        """Repeated and conditional views are served from the page cache"""
+        with app.test_client() as client:
+            response = client.get("/q1/my_id")
+            etag = response.headers["ETag"]
+            cached = client.get("/q1/my_id")
+            conditional = client.get("/q1/my_id", headers={"If-None-Match": etag})
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(conditional.status_code, 304)
+        self.assertIn("public", response.headers["Cache-Control"])
+        self.assertEqual(patched_quote.call_count, 1)
+        self.assertEqual(patched_image.call_count, 1)
+
+    @patch("app.apicalls.get_quote", return_value=("First quote", "Author one", "q1"))
+    @patch(
+        "app.core.imageprocessing.get_image_by_id",
+        return_value=app.config["STANDARD_IMAGE"],
+    )
+    def test_standard_image_not_cached(self, patched_image, patched_quote):
+        """Pages where the image fell back to the standard image are not cached"""
+        with app.test_client() as client:
+            response = client.get("/q1/my_id")
+            client.get("/q1/my_id")
+        self.assertNotIn("ETag", response.headers)
+        self.assertIn("no-store", response.headers["Cache-Control"])
+        self.assertEqual(patched_image.call_count, 2)
+
+    @params((Mock(status_code=404), 404), (Timeout(), 503))
+    def test_quote_unavailable(self, upstream, status):
+        """Unknown quote ids are a 404, failing api calls a 503"""
+        # a side_effect list returns mocks and raises exceptions
+        with patch.object(app.http_session, "get", side_effect=[upstream]), patch(
+            "app.core.imageprocessing.get_image_by_id",
+            return_value=("regular_url", "#000000", "my_id"),
+        ):
+            with app.test_client() as client:
+                response = client.get("/unknown_quote/my_id")
+        self.assertEqual(response.status_code, status)
+        self.assertIsNone(
+            app.page_cache.get(("http://localhost/", "unknown_quote", "my_id", False))
+        )
+
+    @patch("app.core.routes.get_random_pairing", side_effect=QuoteUnavailable("random"))
+    def test_quote_unavailable_json(self, patched_pairing):
+        """Endpoints called by js-functions get the error as json"""
+        with app.test_client() as client:
+            response = client.get("/_get_quote")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("error", response.get_json())
+
+
+class InstrumentedConfig(TestConfig):
+    INSTRUMENTATION_ENABLED = True
+    METRICS_TOKEN = "secret"
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Tests per-stage timings, Server-Timing headers and /metrics"""
+
+    def test_disabled(self):
+        """Without INSTRUMENTATION_ENABLED nothing is observed"""
+        with app.app_context():
+            with timed("upstream", host="example.com"):
+                pass
+        self.assertNotIn("upstream", app.instrumentation.render())
+
+    def test_per_app(self):
+        """An instrumented app does not enable timing for the other apps"""
+        instrumented = create_app(InstrumentedConfig)
+        self.assertTrue(instrumented.instrumentation.enabled)
+        self.assertFalse(app.instrumentation.enabled)
+
+    def test_histogram(self):
+        """Timings are counted in cumulative buckets per stage and labels"""
+        instrumented = create_app(InstrumentedConfig)
+        instrumentation = instrumented.instrumentation
+        instrumentation.observe("upstream", 0.003, host="example.com", status=200)
+        instrumentation.observe("upstream", 0.3, host="example.com", status=200)
+        with instrumented.app_context(), timed("tagging"):
+            pass
+        text = instrumentation.render()
+        labels = 'stage="upstream",host="example.com",status="200"'
+        self.assertIn(f'quote_stage_seconds_bucket{{{labels},le="0.001"}} 0', text)
+        self.assertIn(f'quote_stage_seconds_bucket{{{labels},le="0.005"}} 1', text)
+        self.assertIn(f'quote_stage_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f"quote_stage_seconds_count{{{labels}}} 2", text)
+        self.assertIn('quote_stage_seconds_count{stage="tagging"} 1', text)
+
+    def test_server_timing(self):
+        """Repeated stages are summed up, the total comes last"""
+        self.assertEqual(
+            server_timing([("upstream", 0.01), ("render", 0.002), ("upstream", 0.02)], 0.05),
+            'upstream;dur=30.0;desc="2x", render;dur=2.0, total;dur=50.0',
+        )
+
+    def test_server_timing_header(self):
+        """Stages run on the executor count towards the submitting request"""
+        instrumented = create_app(InstrumentedConfig)
+
+        @instrumented.route("/_timed")
+        def timed_view():
+            def stage():
+                with timed("upstream", host="example.com"):
+                    pass
+
+            submit(stage).result()
+            with timed("render"):
+                return "ok"
+
+        with instrumented.test_client() as client:
+            response = client.get("/_timed")
+            metrics = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        header = response.headers["Server-Timing"]
+        self.assertIn("upstream;dur=", header)
+        self.assertIn("render;dur=", header)
+        self.assertIn("total;dur=", header)
+        self.assertEqual(metrics.mimetype, "text/plain")
+        self.assertIn(
+            b'quote_stage_seconds_count{stage="request",endpoint="timed_view",status="200"} 1',
+            metrics.data,
+        )
+
+    def test_metrics_token(self):
+        """Metrics are only served with the configured bearer token"""
+        instrumented = create_app(InstrumentedConfig)
+        with instrumented.test_client() as client:
+            for path in ("/metrics", "/_metrics"):
+                self.assertEqual(client.get(path).status_code, 404)
+                wrong = client.get(path, headers={"Authorization": "Bearer wrong"})
+                self.assertEqual(wrong.status_code, 404)
+            authorized = client.get("/_metrics", headers={"Authorization": "Bearer secret"})
+            self.assertEqual(authorized.status_code, 200)
+        with app.test_client() as client:
+            unset = client.get("/metrics", headers={"Authorization": "Bearer "})
+            self.assertEqual(unset.status_code, 404)
+
+
+class TestProfiler(unittest.TestCase):
+    """Tests sampled and slow request profiles and their aggregation"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_app(self, **config):
+        config = dict(config, PROFILE_DIR=self.directory.name)
+        profiled = create_app(type("ProfiledConfig", (TestConfig,), config))
+
+        @profiled.route("/_upstream")
+        def upstream_view():
+            with timed("upstream", host="example.com") as timing:
+                timing.labels["status"] = 200
+            return "ok"
+
+        @profiled.route("/_slow")
+        def slow_view():
+            time.sleep(0.05)
+            return "ok"
+
+        return profiled
+
+    def test_sampled_request(self):
+        """Sampled requests are dumped with cProfile stats and upstream calls"""
+        profiled = self.create_app(PROFILE_SAMPLE_RATE=1.0)
+        with profiled.test_client() as client:
+            client.get("/_upstream")
+        profiles = load_profiles(self.directory.name)
+        self.assertEqual(len(profiles), 1)
+        metadata = profiles[0]["metadata"]
+        self.assertEqual(metadata["endpoint"], "upstream_view")
+        self.assertEqual(metadata["reason"], "sampled")
+        self.assertEqual(metadata["upstream_calls"], 1)
+        self.assertEqual(metadata["upstream"][0]["host"], "example.com")
+        self.assertEqual(metadata["upstream"][0]["status"], "200")
+        self.assertTrue(
+            any("upstream_view" in f["function"] for f in profiles[0]["functions"])
+        )
+        self.assertEqual(
+            len([name for name in os.listdir(self.directory.name) if name.endswith(".prof")]),
+            1,
+        )
+
+    def test_slow_request(self):
+        """Only requests slower than the threshold are dumped, from stack samples"""
+        profiled = self.create_app(
+            PROFILE_SLOW_THRESHOLD=0.03, PROFILE_SAMPLER_INTERVAL=0.001
+        )
+        with profiled.test_client() as client:
+            client.get("/_upstream")
+            client.get("/_slow")
+        profiles = load_profiles(self.directory.name)
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]["metadata"]["endpoint"], "slow_view")
+        self.assertEqual(profiles[0]["metadata"]["reason"], "slow")
+        self.assertTrue(profiles[0]["metadata"]["slow"])
+        self.assertTrue(
+            any("slow_view" in f["function"] for f in profiles[0]["functions"])
+        )
+
+    def test_max_dumps(self):
+        """The oldest dumps are removed beyond PROFILE_MAX_DUMPS"""
+        profiled = self.create_app(PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_DUMPS=2)
+        with profiled.test_client() as client:
+            for _ in range(4):
+                client.get("/_upstream")
+        self.assertEqual(len(os.listdir(self.directory.name)), 4)
+
+    def test_sample_functions(self):
+        """Self time counts the innermost function, cumulative every function once"""
+        main, view, helper = ("a.py", 1, "main"), ("a.py", 5, "view"), ("b.py", 1, "helper")
+        functions = {
+            function["function"]: function
+            for function in sample_functions(
+                {(main, view): 3, (main, view, helper, helper): 1}, 0.01
+            )
+        }
+        self.assertAlmostEqual(functions["a.py:1(main)"]["cumulative"], 0.04)
+        self.assertAlmostEqual(functions["a.py:1(main)"]["self"], 0.0)
+        self.assertAlmostEqual(functions["a.py:5(view)"]["self"], 0.03)
+        self.assertAlmostEqual(functions["b.py:1(helper)"]["cumulative"], 0.01)
+
+    def test_aggregate_profiles(self):
+        """Functions are summed up over the dumps"""
+        profiles = [
+            {"functions": [{"function": "f", "calls": 1, "self": 0.1, "cumulative": 0.2}]},
+            {
+                "functions": [
+                    {"function": "f", "calls": 2, "self": 0.1, "cumulative": 0.1},
+                    {"function": "g", "calls": 9, "self": 0.25, "cumulative": 0.25},
+                ]
+            },
+        ]
+        top = aggregate_profiles(profiles, "cumulative", limit=1)
+        self.assertEqual(top[0]["function"], "f")
+        self.assertEqual(top[0]["calls"], 3)
+        self.assertEqual(top[0]["profiles"], 2)
+        self.assertEqual(aggregate_profiles(profiles, "self")[0]["function"], "g")
+
+
+class TestLastSeenTracker(unittest.TestCase):
+    """Tests coalesced last_seen writes"""
+
+    def setUp(self):
+        self.user = User(username="susan", last_seen=datetime(2000, 1, 1))
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        User.query.delete()
+        db.session.commit()
+
+    def test_activity_coalesced(self):
+        """Repeated activity within the granularity is written once"""
+        tracker = LastSeenTracker(app, flush_interval=3600, granularity=60)
+        for _ in range(5):
+            tracker.record(self.user.id)
+        self.assertEqual(User.query.get(self.user.id).last_seen, datetime(2000, 1, 1))
+
+        result = tracker.flush()
+        db.session.expire_all()
+        self.assertEqual(result, 1)
+        self.assertGreater(User.query.get(self.user.id).last_seen, datetime(2000, 1, 1))
+        self.assertEqual(tracker.stats()["writes_saved"], 4)
+
+    def test_flush_interval(self):
+        """Activity after the flush interval triggers a flush"""
+        tracker = LastSeenTracker(app, flush_interval=0, granularity=0)
+        tracker.record(self.user.id)
+        self.assertEqual(tracker.stats()["flushes"], 1)
+
+    def test_failed_flush_kept_pending(self):
+        """Activity of a failed flush is written by the next flush"""
+        tracker = LastSeenTracker(app, flush_interval=3600, granularity=60)
+        tracker.record(self.user.id)
+        with patch.object(db.session, "execute", side_effect=OperationalError("", {}, None)):
+            with self.assertRaises(OperationalError):
+                tracker.flush()
+        self.assertEqual(tracker.stats()["pending"], 1)
+        self.assertEqual(tracker.flush(), 1)
+
+
+class TestQuoteDrawer(unittest.TestCase):
+    """Tests paginated quote-drawer"""
+
+    def setUp(self):
+        self.user = User(username="susan")
+        db.session.add(self.user)
+        db.session.commit()
+        for i in range(5):
+            db.session.add(
+                Quote(
+                    quote_id=f"q{i}",
+                    image_id="my_id",
+                    quote=f"Quote {i}",
+                    author="Author",
+                    user_id=self.user.id,
+                )
+            )
+        db.session.commit()
+
+    def tearDown(self):
+        Quote.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    @patch.dict(app.config, {"QUOTES_PER_PAGE": 2})
+    def test_keyset_pages(self):
+        """Pages follow each other without gaps or duplicates"""
+        quote_ids, after = [], None
+        while True:
+            rows, after = get_saved_quotes(self.user.id, after)
+            quote_ids += [row.quote_id for row in rows]
+            if after is None:
+                break
+        self.assertEqual(quote_ids, [f"q{i}" for i in range(5)])
+
+    @patch.dict(app.config, {"QUOTES_PER_PAGE": 3})
+    def test_json_page(self):
+        """Json variant returns a page and the next key"""
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session["user_id"] = str(self.user.id)
+            data = client.get("/_myquotes").get_json()
+            page = client.get("/myquotes")
+        self.assertEqual([q["quote_id"] for q in data["quotes"]], ["q0", "q1", "q2"])
+        self.assertIsNotNone(data["next"])
+        self.assertIn(b"Quote 2", page.data)
+        self.assertIn(b"after=", page.data)
+
+    def test_login_required(self):
+        """Anonymous users are redirected to login"""
+        with app.test_client() as client:
+            response = client.get("/_myquotes")
+        self.assertEqual(response.status_code, 302)
+
+
+class TestSaveQuote(unittest.TestCase):
+    """Tests saving quotes"""
+
+    quote = {"quote_id": "q1", "image_id": "my_id", "quote": "Quote", "author": "Author"}
+
+    def setUp(self):
+        self.user = User(username="susan")
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["user_id"] = str(self.user.id)
+
+    def tearDown(self):
+        Quote.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_save_once(self):
+        """Second save of the same combination is reported, not inserted"""
+        first = self.client.post("/save", data=self.quote).get_json()
+        second = self.client.post("/save", data=self.quote).get_json()
+        self.assertEqual(first, {"succes": "Quote saved"})
+        self.assertEqual(second, {"error": "Quote already saved"})
+        self.assertEqual(Quote.query.count(), 1)
+
+    def test_bulk_save(self):
+        """Bulk save inserts new combinations and skips saved ones"""
+        self.client.post("/save", data=self.quote)
+        other = dict(self.quote, image_id="other_id")
+        result = self.client.post(
+            "/save/bulk", json={"quotes": [self.quote, other, other]}
+        ).get_json()
+        self.assertEqual(result, {"saved": 1, "already_saved": 2})
+        self.assertEqual(Quote.query.count(), 2)
+
+    def test_bulk_save_invalid(self):
+        """Bulk save with missing keys saves nothing"""
+        result = self.client.post(
+            "/save/bulk", json={"quotes": [{"quote_id": "q1"}]}
+        ).get_json()
+        self.assertIn("error", result)
+        self.assertEqual(Quote.query.count(), 0)
+
+    @params(
+        {"quote_id": {"a": 1}},
+        {"author": None},
+        {"image_id": "x" * 65},
+    )
+    def test_bulk_save_malformed(self, fields):
+        """Bulk save with non-string or too long values saves nothing"""
+        result = self.client.post(
+            "/save/bulk", json={"quotes": [self.quote, dict(self.quote, **fields)]}
+        ).get_json()
+        self.assertIn("error", result)
+        self.assertEqual(Quote.query.count(), 0)
+
+
+class TestRating(unittest.TestCase):
+    """Tests quote ratings and their aggregates"""
+
+    def setUp(self):
+        self.user = User(username="susan")
+        self.other = User(username="john")
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["user_id"] = str(self.user.id)
+
+    def tearDown(self):
+        Rating.query.delete()
+        QuoteRating.query.delete()
+        User.query.delete()
+        CorpusQuote.query.delete()
+        db.session.commit()
+        app.quote_sampler.invalidate()
+
+    def test_aggregate(self):
+        """Votes are aggregated as they are cast, a new vote replaces the old"""
+        Rating.rate(self.user.id, "q1", 5)
+        Rating.rate(self.other.id, "q1", 2)
+        result = Rating.rate(self.user.id, "q1", 4)
+        self.assertEqual((result.count, result.total), (2, 6))
+        self.assertEqual(result.mean, 3)
+        # (6 + 3.0 * 5) / (2 + 5)
+        self.assertAlmostEqual(result.bayesian_mean, 3.0)
+        self.assertEqual(Rating.query.count(), 2)
+
+    def test_rate_endpoint(self):
+        """Rating returns the aggregate, which is also served to others"""
+        result = self.client.post("/rate", data={"quote_id": "q1", "score": 5})
+        self.assertEqual(result.get_json(), {"count": 1, "mean": 5})
+        result = app.test_client().get("/_rating/q1").get_json()
+        self.assertEqual(result, {"count": 1, "mean": 5})
+
+    @params("0", "6", "five")
+    def test_rate_invalid_score(self, score):
+        """Scores outside 1-5 are refused"""
+        result = self.client.post("/rate", data={"quote_id": "q1", "score": score})
+        self.assertIn("error", result.get_json())
+        self.assertEqual(Rating.query.count(), 0)
+
+    def test_weighted_sampler(self):
+        """Sampler picks up the ratings of corpus quotes"""
+        add_quotes_to_corpus(
+            [
+                {"_id": "q1", "content": "First quote", "author": "Author one"},
+                {"_id": "q2", "content": "Second quote", "author": "Author two"},
+            ]
+        )
+        Rating.rate(self.user.id, "q1", 1)
+        sampler = QuoteSampler(weighted=True, prior_mean=3.0, exponent=1)
+        sampler.ids()
+        # q1: (1 + 3.0 * 5) / (1 + 5), q2 unrated: prior mean
+        self.assertAlmostEqual(sampler._weights.total(), 16 / 6 + 3.0)
+
+        q1 = CorpusQuote.query.filter_by(quote_id="q1").first()
+        sampler.reweigh(q1.id, 0.0)
+        q2 = CorpusQuote.query.filter_by(quote_id="q2").first()
+        self.assertEqual({sampler.sample() for _ in range(20)}, {q2.id})
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    """Tests similar-quote index"""
+
+    quotes = {
+        "q1": "Love is the answer to every question of the heart",
+        "q2": "The heart has reasons that reason does not know",
+        "q3": "Money is a good servant but a bad master",
+        "q4": "A bad master makes a bad servant",
+    }
+    records = [
+        {"_id": quote_id, "content": quote, "author": "Author"}
+        for quote_id, quote in quotes.items()
+    ]
+
+    def test_features(self):
+        """Short words are skipped, nouns count once more"""
+        result = get_quote_features("To be a hero", [("hero", 1)])
+        self.assertEqual(result, {"hero": 2})
+
+    def test_similar(self):
+        """Quotes sharing rare terms rank first, the quote itself is excluded"""
+        index = SimilarityIndex()
+        for quote_id, quote in self.quotes.items():
+            index.add(quote_id, get_quote_features(quote, []))
+        result = index.similar("q3", k=3)
+        self.assertEqual(result[0][0], "q4")
+        self.assertNotIn("q3", [quote_id for quote_id, _ in result])
+        self.assertIsNone(index.similar("unknown"))
+
+    def test_incremental(self):
+        """Quotes added after a query are found by the next query"""
+        index = SimilarityIndex()
+        index.add("q1", get_quote_features(self.quotes["q1"], []))
+        index.add("q3", get_quote_features(self.quotes["q3"], []))
+        self.assertEqual(index.similar("q1"), [])
+        index.add("q2", get_quote_features(self.quotes["q2"], []))
+        self.assertEqual(index.similar("q1")[0][0], "q2")
+
+    def test_similar_endpoint(self):
+        """Endpoint indexes the corpus in the background and returns the similar quotes"""
+        add_quotes_to_corpus(self.records)
+        db.session.add_all(
+            QuoteNouns(quote_id=quote_id, nouns="[]", tagger_version=tagger.version)
+            for quote_id in self.quotes
+        )
+        db.session.commit()
+        index = CorpusSimilarityIndex(app)
+        try:
+            with patch.object(app, "similarity_index", index), app.test_client() as client:
+                pending = client.get("/similar/q1?k=1").get_json()
+                index._thread.join()
+                result = client.get("/similar/q1?k=1").get_json()
+                missing = client.get("/similar/unknown")
+                index._thread.join()
+        finally:
+            CorpusQuote.query.delete()
+            QuoteNouns.query.delete()
+            db.session.commit()
+            app.quote_sampler.invalidate()
+        self.assertEqual(pending, {"quotes": [], "pending": True})
+        self.assertEqual([quote["quote_id"] for quote in result["quotes"]], ["q2"])
+        self.assertEqual(missing.status_code, 404)
+
+    def test_forced_sync_rate_limited(self):
+        """Forced syncs for quotes that are not indexed run at most every force_interval"""
+        index = CorpusSimilarityIndex(app, force_interval=60)
+        with patch.object(index, "sync") as patched_sync:
+            self.assertTrue(index.sync_in_background(force=True))
+            index._thread.join()
+            self.assertFalse(index.sync_in_background(force=True))
+        patched_sync.assert_called_once_with(force=True)
+
+
+class TestFenwickTree(unittest.TestCase):
+    """Tests weighted sampling tree"""
+
+    def test_find(self):
+        """Index is found by running sum of weights"""
+        tree = FenwickTree([1.0, 0.0, 2.0, 3.0, 1.0])
+        self.assertEqual(tree.total(), 7.0)
+        self.assertEqual(
+            [tree.find(value) for value in [0, 0.5, 1, 2.9, 3, 5.9, 6, 6.9]],
+            [0, 0, 2, 2, 3, 3, 4, 4],
+        )
+
+    def test_update(self):
+        """Changed weight is reflected in total and draws"""
+        tree = FenwickTree([1.0, 1.0, 1.0])
+        tree.update(1, 0.0)
+        self.assertEqual(tree.total(), 2.0)
+        self.assertNotIn(1, {tree.sample() for _ in range(100)})
+
+    def test_append(self):
+        """Appended weights give the same tree as building it at once"""
+        weights = [1.0, 0.0, 2.0, 3.0, 1.0, 4.0, 0.5]
+        tree = FenwickTree([])
+        for weight in weights:
+            tree.append(weight)
+        self.assertEqual(list(tree._tree), list(FenwickTree(weights)._tree))
+
+
+class TestUserCache(unittest.TestCase):
+    """Tests cached user_loader"""
+
+    def setUp(self):
+        self.user = User(username="susan")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        User.query.delete()
+        db.session.commit()
+        app.user_cache.clear()
+
+    def test_snapshot_cached(self):
+        """User is loaded once, as read-only snapshot"""
+        load_user(str(self.user.id))
+        with patch("app.models.User.query") as patched_query:
+            result = load_user(str(self.user.id))
+        patched_query.get.assert_not_called()
+        self.assertIsInstance(result, UserSnapshot)
+        self.assertEqual(result.username, "susan")
+        with self.assertRaises(AttributeError):
+            result.username = "other"
+
+    def test_invalidated_on_change(self):
+        """Changing the user drops the cached snapshot"""
+        load_user(str(self.user.id))
+        self.user.set_password("cat")
+        self.user.username = "susan2"
+        db.session.commit()
+        self.assertEqual(load_user(str(self.user.id)).username, "susan2")
+
+    def test_session_only_endpoint(self):
+        """Polling endpoint records activity without loading the user"""
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session["user_id"] = str(self.user.id)
+            # flask-login calls the loader it registered, not app.models.load_user
+            with patch("app.core.routes.get_random_pairing") as patched_pairing, patch.object(
+                login, "user_callback", wraps=load_user
+            ) as patched_loader, patch.object(app.last_seen, "record") as patched_record:
+                patched_pairing.return_value = TestPairingBuffer.pairing
+                client.get("/_get_quote")
+                patched_loader.assert_not_called()
+                patched_record.assert_called_once_with(self.user.id)
+                # endpoints with login_required do load the user
+                client.get("/_myquotes")
+                patched_loader.assert_called_once_with(str(self.user.id))
+
+
 class TestValidRequest(unittest.TestCase):
     """Tests request validator"""
 